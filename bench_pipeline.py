@@ -0,0 +1,186 @@
+"""Бенчмарк конвейера данных и построения графиков (без запуска интерфейса Streamlit).
+
+Замеряет get_week_info, clean_data_types, filter_data_by_period, query_periods и render_chart на синтетической
+истории разного размера: время (лучшее и среднее из повторов), пиковую память и число новых
+блоков памяти по tracemalloc. Результаты печатаются таблицей и сохраняются в JSON, который
+можно сравнить с предыдущим прогоном (--baseline).
+
+Пример:
+    python bench_pipeline.py --sizes 1000 100000 1000000 10000000
+    python bench_pipeline.py --sizes 1000 100000 --baseline bench_results/prev.json
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import plotly
+
+from kpi_charts import render_chart
+from kpi_data import (CATEGORY_COLUMNS, MOCK_KPI_PARAMS, clean_data_types, filter_data_by_period,
+                      generate_mock_data, get_week_info, get_week_info_vectorized, query_periods)
+
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000, 10_000_000]
+HISTORY_YEARS = 3
+CHART_KPI = "Выполнение общего плана фандрайзинга, %"
+
+
+def make_history(n_rows, seed):
+    """Типизированная история ровно из n_rows строк за HISTORY_YEARS лет (размер набирается филиалами)."""
+    rng = np.random.default_rng(seed)
+    rows_per_branch = HISTORY_YEARS * 52 * len(MOCK_KPI_PARAMS) * 0.9
+    branches = max(1, math.ceil(n_rows * 1.05 / rows_per_branch))
+    df = generate_mock_data(years=HISTORY_YEARS, branches=branches, rng=rng, end_date="2025-12-31")
+    if len(df) > n_rows:
+        df = df.iloc[np.sort(rng.choice(len(df), n_rows, replace=False))].reset_index(drop=True)
+    return df.drop(columns="Филиал")
+
+
+def to_raw(df):
+    """«Сырая» копия, как из редактора: строки вместо категорий, Python date вместо datetime64."""
+    raw = df.astype({col: object for col in CATEGORY_COLUMNS})
+    raw['Дата_Начала'] = raw['Дата_Начала'].dt.date
+    raw.attrs = {}
+    return raw
+
+
+def measure(fn, setup, repeat):
+    """Время (без tracemalloc) и отдельный прогон под tracemalloc для памяти."""
+    # Прогрев: ленивые импорты и кэши Plotly/pandas не должны попадать в первый замер
+    fn(setup())
+
+    times = []
+    for _ in range(repeat):
+        arg = setup()
+        gc.collect()
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+        del arg
+
+    arg = setup()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    base_current, _ = tracemalloc.get_traced_memory()
+    result = fn(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    new_blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    del result, arg, before, after
+
+    return {
+        "time_best_s": min(times),
+        "time_mean_s": sum(times) / len(times),
+        "peak_memory_bytes": peak - base_current,
+        "new_blocks": new_blocks,
+    }
+
+
+def run_case(name, n_rows, fn, setup, repeat, results):
+    print(f"  {name:<34}", end="", flush=True)
+    metrics = measure(fn, setup, repeat)
+    results.append({"case": name, "rows": n_rows, **metrics})
+    print(f"{metrics['time_best_s']:>10.4f} s {metrics['peak_memory_bytes'] / 2 ** 20:>10.1f} MiB"
+          f" {metrics['new_blocks']:>10}")
+
+
+def bench_size(n_rows, repeat, max_scalar_rows, seed, results):
+    print(f"\n== {n_rows:,} строк ==")
+    typed = make_history(n_rows, seed)
+    raw = to_raw(typed)
+    dates = raw['Дата_Начала'].tolist()
+    last_month = typed['Дата_Начала'].max().strftime('%Y-%m')
+
+    if n_rows <= max_scalar_rows:
+        run_case("get_week_info (по строкам)", n_rows,
+                 lambda ds: [get_week_info(d) for d in ds], lambda: dates, repeat, results)
+    else:
+        print(f"  {'get_week_info (по строкам)':<34}пропущено (> --max-scalar-rows)")
+    run_case("get_week_info_vectorized", n_rows, get_week_info_vectorized, lambda: dates, repeat, results)
+
+    # clean_data_types изменяет вход и пропускает уже проверенные таблицы — каждый раз свежая копия
+    run_case("clean_data_types", n_rows, clean_data_types, lambda: raw.copy(), repeat, results)
+
+    run_case("filter_data_by_period (год)", n_rows,
+             lambda df: filter_data_by_period(df, "Год (по месяцам)"), lambda: typed, repeat, results)
+    run_case("filter_data_by_period (месяц)", n_rows,
+             lambda df: filter_data_by_period(df, "Месяц (по неделям)", last_month), lambda: typed, repeat, results)
+    run_case("query_periods (квартал, г/г)", n_rows,
+             lambda df: query_periods(df, "quarter", yoy=True), lambda: typed, repeat, results)
+    run_case("query_periods (окно 4 нед.)", n_rows,
+             lambda df: query_periods(df, "week", window=4), lambda: typed, repeat, results)
+
+    df_year = filter_data_by_period(typed, "Год (по месяцам)")
+    run_case("render_chart (год)", n_rows, lambda df: render_chart(df, CHART_KPI), lambda: df_year, repeat, results)
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Печатает изменение времени относительно прошлого прогона."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["case"], r["rows"]): r for r in json.load(f)["results"]}
+    print(f"\n== Сравнение с {baseline_path} (лучшее время) ==")
+    for r in results:
+        prev = baseline.get((r["case"], r["rows"]))
+        if prev and prev["time_best_s"] > 0:
+            ratio = r["time_best_s"] / prev["time_best_s"]
+            flag = "  <-- медленнее" if ratio > 1.2 else ""
+            print(f"  {r['case']:<34}{r['rows']:>12,} {ratio:>8.2f}x{flag}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="размеры истории, строк")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов на замер времени")
+    parser.add_argument("--max-scalar-rows", type=int, default=1_000_000,
+                        help="предел строк для построчного get_week_info")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="JSON с результатами (по умолчанию bench_results/)")
+    parser.add_argument("--baseline", default=None, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args(argv)
+
+    print(f"{'case':<36}{'best':>10}   {'peak':>10}     {'blocks':>10}")
+    results = []
+    for n_rows in args.sizes:
+        bench_size(n_rows, args.repeat, args.max_scalar_rows, args.seed, results)
+
+    output = args.output or os.path.join("bench_results", f"bench_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "git_revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "versions": {"pandas": pd.__version__, "numpy": np.__version__, "plotly": plotly.__version__},
+        "repeat": args.repeat,
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты сохранены: {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
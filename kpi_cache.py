@@ -0,0 +1,65 @@
+import threading
+from collections import OrderedDict
+
+# --- ОБЩИЙ КЭШ РЕЗУЛЬТАТОВ ---
+# Один экземпляр на процесс (через st.cache_resource) обслуживает все сессии Streamlit: агрегат,
+# фигура или файл выгрузки строится один раз на версию данных и отдается каждому зрителю.
+
+
+class SharedCache:
+    """Потокобезопасный LRU-кэш неизменяемых результатов.
+
+    Ключ включает версию данных: после записи в базу версия меняется, новые ключи строятся заново,
+    а старые вытесняются как самые давно использованные. Значения общие для всех сессий и не
+    копируются при выдаче, поэтому вызывающий обязан только читать их: не менять на месте
+    DataFrame (срезы и производные таблицы безопасны — в pandas >= 3 копирование при записи
+    включено всегда) и не вызывать update_*/add_* у фигур Plotly, а лишь передавать их
+    в st.plotly_chart, который их только сериализует.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key, build):
+        """Возвращает (значение, найдено_в_кэше); при промахе строит его через build().
+
+        Одновременные промахи по одному ключу (несколько сессий сразу после записи) ждут одной
+        сборки, а не строят значение каждая для себя.
+        """
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key], True
+            key_lock = self._building.setdefault(key, threading.Lock())
+
+        # Строим вне общей блокировки: сборки разных ключей не ждут друг друга
+        with key_lock:
+            with self._lock:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return self._items[key], True
+                self.misses += 1
+            try:
+                value = build()
+            except BaseException:
+                with self._lock:
+                    self._building.pop(key, None)
+                raise
+            # Публикуем готовое значение и снимаем отметку о сборке одним шагом
+            with self._lock:
+                self._items[key] = value
+                self._items.move_to_end(key)
+                self._building.pop(key, None)
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+        return value, False
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,178 @@
+import numpy as np
+import plotly.graph_objects as go
+
+from kpi_data import STATUS_GREEN, STATUS_LABELS, STATUS_RED, STATUS_YELLOW
+
+# --- ГРАФИКИ KPI ---
+# Построение фигур Plotly из агрегатов filter_data_by_period / KPIStore.rollup (без Streamlit).
+
+# Длинные ряды (тысячи периодов на KPI) рисуются через WebGL, а Факт прореживается алгоритмом LTTB
+WEBGL_THRESHOLD = 1000
+MAX_POINTS = 1000
+
+
+def lttb_indices(y, n_out):
+    """Индексы точек ряда, отобранных алгоритмом LTTB (Largest-Triangle-Three-Buckets).
+
+    Ось X — порядковый номер периода. Первая и последняя точки сохраняются всегда, из каждой
+    промежуточной корзины берется точка, образующая наибольший треугольник с соседями, —
+    так сохраняются пики и провалы ряда.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    if np.isnan(y).any():
+        # Пропуски заменяем ближайшими значениями только для выбора точек; сами NaN остаются разрывами
+        idx = np.arange(n)
+        valid = ~np.isnan(y)
+        if not valid.any():
+            return np.linspace(0, n - 1, n_out).astype(int)
+        y = np.interp(idx, idx[valid], y[valid])
+    x = np.arange(n, dtype=float)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def change_point_indices(y):
+    """Точки, где ряд меняет значение, плюс концы. Линия через них совпадает с исходной в точности."""
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= 2:
+        return np.arange(n)
+    differs = ~((y[1:] == y[:-1]) | (np.isnan(y[1:]) & np.isnan(y[:-1])))
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    keep[1:] |= differs
+    keep[:-1] |= differs
+    return np.flatnonzero(keep)
+
+
+def build_kpi_index(df_grouped):
+    """Индекс агрегата по KPI: {Название: его строки}. Один groupby вместо маски на каждый график."""
+    if df_grouped.empty:
+        return {}
+    return {str(name): rows for name, rows in df_grouped.groupby('Название', sort=False, observed=True)}
+
+
+def render_chart(df_grouped, kpi_name, title_prefix="Динамика", kpi_index=None, x_range=None,
+                 max_points=MAX_POINTS, webgl_threshold=WEBGL_THRESHOLD):
+    """График KPI: Факт на фоне линий Цель и Минимум.
+
+    x_range=(первый, последний период) — окно детализации: внутри него ряд показывается
+    в полном разрешении, если умещается в max_points. Длиннее webgl_threshold — Scattergl.
+    """
+    if kpi_index is not None:
+        chart_data = kpi_index.get(kpi_name, df_grouped.iloc[:0])
+    else:
+        chart_data = df_grouped[df_grouped['Название'] == kpi_name]
+
+    if chart_data.empty:
+        fig = go.Figure()
+        fig.update_layout(
+            annotations=[dict(text="Нет данных для построения графика", showarrow=False)],
+            xaxis={'visible': False}, yaxis={'visible': False}, height=350, title=f"{title_prefix}: {kpi_name}"
+        )
+        return fig
+
+    if x_range is not None:
+        periods = chart_data['Период'].astype(str).tolist()
+        if x_range[0] in periods and x_range[1] in periods:
+            lo, hi = sorted((periods.index(x_range[0]), periods.index(x_range[1])))
+            chart_data = chart_data.iloc[lo:hi + 1]
+
+    n_points = len(chart_data)
+    scatter = go.Scattergl if n_points > webgl_threshold else go.Scatter
+    x = chart_data['Период'].to_numpy()
+    fact = chart_data['Факт'].to_numpy()
+    fact_idx = lttb_indices(fact, max_points) if n_points > max_points else np.arange(n_points)
+
+    fig = go.Figure()
+    for col, line in (('Цель', dict(color='green', dash='dash')), ('Минимум', dict(color='orange', dash='dot'))):
+        values = chart_data[col].to_numpy()
+        idx = change_point_indices(values) if n_points > max_points else np.arange(n_points)
+        fig.add_trace(scatter(x=x[idx], y=values[idx], name=col, line=line))
+    fig.add_trace(
+        scatter(x=x[fact_idx], y=fact[fact_idx], name='Факт', line=dict(color='blue', width=3),
+                mode='lines+markers'))
+    if 'Факт_ПГ' in chart_data.columns:
+        # Сравнение с прошлым годом (aggregate_periods(..., yoy=True))
+        prev = chart_data['Факт_ПГ'].to_numpy()
+        fig.add_trace(scatter(x=x[fact_idx], y=prev[fact_idx], name='Факт, прошлый год',
+                              line=dict(color='gray', dash='dot')))
+
+    title = f"{title_prefix}: {kpi_name}"
+    if len(fact_idx) < n_points:
+        title += f" (показано {len(fact_idx)} из {n_points} точек)"
+    fig.update_layout(
+        title=title,
+        xaxis_title="Отчетный период",
+        yaxis_title="Значение",
+        margin=dict(l=20, r=20, t=40, b=20),
+        height=350
+    )
+    if len(fact_idx) < n_points:
+        # Прореженные ряды содержат разные подмножества периодов — порядок оси задаем явно
+        fig.update_xaxes(categoryorder='array', categoryarray=x)
+    if len(chart_data['Период'].unique()) > 6:
+        fig.update_xaxes(tickangle=45)
+
+    return fig
+
+
+# Дискретная шкала светофора для статусов 0/1/2 (см. kpi_status)
+STATUS_COLORSCALE = [
+    [0.0, '#e74c3c'], [1 / 3, '#e74c3c'],
+    [1 / 3, '#f1c40f'], [2 / 3, '#f1c40f'],
+    [2 / 3, '#2ecc71'], [1.0, '#2ecc71'],
+]
+
+
+def render_status_heatmap(status, fact, title="Статусы KPI"):
+    """Тепловая карта статусов KPI × период (матрицы из status_table): одна фигура на все KPI."""
+    if status.empty:
+        fig = go.Figure()
+        fig.update_layout(
+            annotations=[dict(text="Нет данных для построения карты", showarrow=False)],
+            xaxis={'visible': False}, yaxis={'visible': False}, height=350, title=title
+        )
+        return fig
+
+    # Подписи статусов по коду (STATUS_LABELS), последний элемент — для пустых ячеек
+    labels = np.array([STATUS_LABELS[code] for code in (STATUS_RED, STATUS_YELLOW, STATUS_GREEN)] + ["Нет данных"],
+                      dtype=object)
+    codes = np.nan_to_num(status.to_numpy(), nan=len(labels) - 1).astype(int)
+    facts = fact.to_numpy(dtype=float)
+    has_fact = ~np.isnan(facts)
+    # Строка «Факт» в подсказке — только для ячеек с фактом (шаблон у Heatmap один на все ячейки)
+    fact_lines = np.full(facts.shape, "", dtype=object)
+    fact_lines[has_fact] = [f"Факт: {value:,.2f}<br>" for value in facts[has_fact]]
+    # object-массив: подпись — строка, факт — число (None вместо NaN)
+    customdata = np.stack([labels[codes], np.where(has_fact, facts, None), fact_lines], axis=-1)
+    fig = go.Figure(go.Heatmap(
+        z=status.to_numpy(), x=status.columns.tolist(), y=status.index.tolist(),
+        zmin=0, zmax=2, colorscale=STATUS_COLORSCALE, showscale=False, xgap=2, ygap=2,
+        customdata=customdata,
+        hovertemplate="%{y}<br>%{x}<br>%{customdata[2]}%{customdata[0]}<extra></extra>",
+    ))
+    fig.update_layout(
+        title=title,
+        margin=dict(l=20, r=20, t=40, b=20),
+        height=max(350, 28 * len(status.index) + 120),
+        yaxis=dict(autorange='reversed'),
+    )
+    if len(status.columns) > 6:
+        fig.update_xaxes(tickangle=45)
+    return fig
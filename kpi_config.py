@@ -0,0 +1,53 @@
+import os
+
+# --- НАСТРОЙКИ И КОНСТАНТЫ ---
+
+# Полная структура KPI
+KPI_STRUCTURE = {
+    "SMM (Вовлеченность)": {
+        "SMM.ER": "ER (Engagement Rate), % [KPI.СММ.1]",
+        "SMM.SHARE": "Share Rate (Репосты), %",
+        "SMM.CTR": "CTR (Клики на сайт), %"
+    },
+    "SMM (Фандрайзинг)": {
+        "SMM.DCR": "DCR (Конверсия в донат), %",
+        "SMM.MONEY": "Сумма сбора SMM, руб. (Часть KPI.ФР.1)"
+    },
+    "Программы": {
+        "KPI.ВС.1": "Заполняемость центров (Верь в себя), %",
+        "KPI.НП.1": "Своевременность решений (Нужна помощь), %",
+        "KPI.НП.2": "Объем адресной помощи, руб.",
+        "KPI.ЯЖ.1": "Мониторинг цел. использования (ЯЖивой), %"
+    },
+    "Финансы": {
+        "KPI.ФР.1_ОБЩИЙ": "Выполнение общего плана фандрайзинга, %",
+        "KPI.ФИН.1": "Соблюдение бюджета (отклонение), %",
+        "KPI.ГР.1": "Грантовая эффективность (заявки/отчеты)"
+    },
+    "HR и Администрирование": {
+        "KPI.HR.1": "Просроченные HR-задачи (Адаптация/Развитие)",
+        "KPI.ВЛ.1": "Прирост базы волонтеров, %",
+        "KPI.ДЕЛ.1": "Своевременность документооборота, %",
+        "KPI.АДМ.1": "Обработка звонков и посетителей, %"
+    }
+}
+
+# Агрегация KPI за период: "mean" — среднее по неделям (проценты, доли), "sum" — сумма (рубли).
+# Не перечисленные здесь KPI агрегируются средним.
+DEFAULT_AGGREGATION = "mean"
+KPI_AGGREGATION = {
+    "SMM.MONEY": "sum",
+    "KPI.НП.2": "sum",
+}
+
+# Определение колонок для создания пустой, но структурированной DF
+REQUIRED_COLUMNS = ["Дата_Начала", "Неделя_Год", "Промежуток_Дат", "Категория", "KPI_ID", "Название", "Минимум", "Цель",
+                    "Факт", "Комментарий"]
+
+# Каталог с базой данных (общей для всех сессий и переживающей перезапуск)
+DATA_DIR = os.environ.get("BBDASHBOARD_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+DB_PATH = os.path.join(DATA_DIR, "kpi_history.sqlite3")
+
+# Диагностика производительности: журнал замеров и включение по умолчанию (BBDASHBOARD_PROFILE=1)
+METRICS_LOG_PATH = os.path.join(DATA_DIR, "metrics.jsonl")
+PROFILE_BY_DEFAULT = os.environ.get("BBDASHBOARD_PROFILE", "") == "1"
@@ -0,0 +1,514 @@
+from datetime import datetime, timedelta, date
+
+import numpy as np
+import pandas as pd
+
+from kpi_config import DEFAULT_AGGREGATION, KPI_AGGREGATION, KPI_STRUCTURE, REQUIRED_COLUMNS
+
+# --- ДАННЫЕ KPI: РАСЧЕТ НЕДЕЛЬ, ТЕСТОВЫЕ ДАННЫЕ, ОЧИСТКА, АГРЕГАЦИЯ ---
+# Модуль не зависит от Streamlit, его можно импортировать из хранилища и скриптов.
+
+
+# --- ФУНКЦИЯ ДЛЯ РАСЧЕТА НЕДЕЛИ ---
+def get_week_info(d: date):
+    """Возвращает ID недели (YYYY-WXX) и диапазон дат (DD.MM.YYYY - DD.MM.YYYY)."""
+    start_of_week = d - timedelta(days=d.weekday())
+    end_of_week = start_of_week + timedelta(days=6)
+    week_year_id = start_of_week.strftime('%Y-W%W')
+    date_range = f"{start_of_week.strftime('%d.%m.%Y')} - {end_of_week.strftime('%d.%m.%Y')}"
+    return start_of_week, week_year_id, date_range
+
+
+def get_week_info_vectorized(dates):
+    """Векторный аналог get_week_info для массива дат.
+
+    Возвращает (начало недели — Series datetime64, ID недели, диапазон дат) — последние два как
+    pd.Categorical. Строки форматируются только для уникальных недель, а не для каждой строки.
+    """
+    dates = pd.Series(pd.to_datetime(dates, errors='coerce')).dt.normalize()
+    starts = (dates - pd.to_timedelta(dates.dt.weekday, unit='D')).astype('datetime64[ns]')
+    weeks = pd.DatetimeIndex(starts.dropna().unique()).sort_values()
+    codes = weeks.get_indexer(starts)  # -1 для пустых дат -> NaN в категориях
+    week_ids = weeks.strftime('%Y-W%W')
+    date_ranges = weeks.strftime('%d.%m.%Y') + ' - ' + (weeks + pd.Timedelta(days=6)).strftime('%d.%m.%Y')
+    return starts, pd.Categorical.from_codes(codes, week_ids), pd.Categorical.from_codes(codes, date_ranges)
+
+
+# --- ГЕНЕРАЦИЯ ТЕСТОВЫХ ДАННЫХ ---
+# Параметры тестовых значений: (Минимум, Цель, закон распределения Факта).
+# "normal" — около цели, "uniform" — суммы в рублях, "lower_better" — чем меньше, тем лучше.
+MOCK_KPI_PARAMS = {
+    "SMM.ER": (2.5, 4.0, "normal"),
+    "SMM.SHARE": (0.5, 1.0, "normal"),
+    "SMM.CTR": (1.0, 2.0, "normal"),
+    "SMM.DCR": (1.0, 2.0, "normal"),
+    "SMM.MONEY": (40000.0, 60000.0, "uniform"),
+    "KPI.ВС.1": (85.0, 95.0, "normal"),
+    "KPI.НП.1": (90.0, 100.0, "normal"),
+    "KPI.НП.2": (100000.0, 150000.0, "uniform"),
+    "KPI.ЯЖ.1": (90.0, 100.0, "normal"),
+    "KPI.ФР.1_ОБЩИЙ": (80.0, 100.0, "normal"),
+    "KPI.ФИН.1": (5.0, 0.0, "lower_better"),
+    "KPI.ГР.1": (70.0, 90.0, "normal"),
+    "KPI.HR.1": (5.0, 0.0, "lower_better"),
+    "KPI.ВЛ.1": (3.0, 5.0, "normal"),
+    "KPI.ДЕЛ.1": (90.0, 100.0, "normal"),
+    "KPI.АДМ.1": (90.0, 100.0, "normal"),
+}
+
+
+def generate_mock_data(years=1, branches=None, rng=None, end_date=None, kpi_ids=None, fill_rate=0.9):
+    """Генерирует тестовую историю: недели за years лет (с 1 января) × KPI × филиалы.
+
+    Все значения считаются на массивах, поэтому миллионы строк строятся за секунды
+    (для нагрузочного тестирования). rng — np.random.Generator для воспроизводимости,
+    branches — число или список филиалов (добавляет колонку "Филиал", в базе она не хранится),
+    fill_rate — доля заполненных (KPI, неделя).
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    end_date = pd.Timestamp(datetime.now() if end_date is None else end_date).normalize()
+    start_date = pd.Timestamp(end_date.year - years + 1, 1, 1)
+
+    # Все понедельники, начиная с недели, в которую попадает 1 января
+    weeks = pd.date_range(start_date - pd.Timedelta(days=start_date.weekday()), end_date, freq='W-MON')
+    week_starts, week_ids, date_ranges = get_week_info_vectorized(weeks)
+
+    kpi_ids = list(MOCK_KPI_PARAMS) if kpi_ids is None else list(kpi_ids)
+    if branches is None:
+        branch_names = [None]
+    elif isinstance(branches, int):
+        branch_names = [f"Филиал {i + 1}" for i in range(branches)]
+    else:
+        branch_names = list(branches)
+
+    # Сетка неделя × KPI × филиал, из которой случайно выбрасываем ~(1 - fill_rate) ячеек
+    n_weeks, n_kpis, n_branches = len(weeks), len(kpi_ids), len(branch_names)
+    week_idx = np.repeat(np.arange(n_weeks), n_kpis * n_branches)
+    kpi_idx = np.tile(np.repeat(np.arange(n_kpis), n_branches), n_weeks)
+    branch_idx = np.tile(np.arange(n_branches), n_weeks * n_kpis)
+    keep = rng.random(len(week_idx)) < fill_rate
+    week_idx, kpi_idx, branch_idx = week_idx[keep], kpi_idx[keep], branch_idx[keep]
+
+    params = [MOCK_KPI_PARAMS[k] for k in kpi_ids]
+    min_vals = np.array([p[0] for p in params])[kpi_idx]
+    target_vals = np.array([p[1] for p in params])[kpi_idx]
+    kinds = np.array([p[2] for p in params])[kpi_idx]
+
+    fact = rng.normal(target_vals, np.abs(target_vals) * 0.15)
+    uniform = kinds == "uniform"
+    fact[uniform] = rng.uniform(min_vals[uniform] * 0.8, target_vals[uniform] * 1.2)
+    lower_better = kinds == "lower_better"
+    fact[lower_better] = np.abs(rng.normal(2, 2, lower_better.sum()))
+    fact = np.round(np.maximum(fact, 0), 2)
+
+    # Категории и названия — из KPI_STRUCTURE, сразу кодами категориальных колонок схемы
+    category_of = {kpi_id: cat for cat, kpis in KPI_STRUCTURE.items() for kpi_id in kpis}
+    name_of = {kpi_id: name for kpis in KPI_STRUCTURE.values() for kpi_id, name in kpis.items()}
+
+    def known_codes(col, values):
+        categories = CATEGORY_COLUMNS[col] + sorted(set(values) - set(CATEGORY_COLUMNS[col]))
+        lookup = {v: i for i, v in enumerate(categories)}
+        return pd.Categorical.from_codes(np.array([lookup[v] for v in values])[kpi_idx], categories)
+
+    df = pd.DataFrame({
+        "Дата_Начала": week_starts.to_numpy()[week_idx],
+        "Неделя_Год": pd.Categorical.from_codes(week_ids.codes[week_idx], week_ids.categories),
+        "Промежуток_Дат": pd.Categorical.from_codes(date_ranges.codes[week_idx], date_ranges.categories),
+        "Категория": known_codes("Категория", [category_of.get(k, "Прочее") for k in kpi_ids]),
+        "KPI_ID": known_codes("KPI_ID", kpi_ids),
+        "Название": known_codes("Название", [name_of[k] for k in kpi_ids]),
+        "Минимум": min_vals,
+        "Цель": target_vals,
+        "Факт": fact,
+        "Комментарий": np.full(len(fact), "", dtype=object),
+    })
+    if branches is not None:
+        df["Филиал"] = pd.Categorical.from_codes(branch_idx, branch_names)
+    return mark_validated(df)
+
+
+# --- ФУНКЦИЯ ПРИНУДИТЕЛЬНОЙ ОЧИСТКИ ДАННЫХ ---
+# Версия схемы (набор колонок и их типы). Очищенная таблица помечается ею в df.attrs,
+# поэтому повторная очистка уже проверенных данных ничего не стоит. pandas переносит attrs через
+# astype/копии и т.п., поэтому отметке верим только вместе с проверкой типов колонок (это O(колонок)).
+SCHEMA_VERSION = 2
+
+NUMERICAL_COLUMNS = ['Минимум', 'Цель', 'Факт']
+
+# Повторяющиеся строки храним как категории. Известные значения берем из KPI_STRUCTURE,
+# встреченные в данных (например, переименованный KPI) добавляются к ним.
+CATEGORY_COLUMNS = {
+    'Категория': list(KPI_STRUCTURE),
+    'KPI_ID': [kpi_id for kpis in KPI_STRUCTURE.values() for kpi_id in kpis],
+    'Название': [name for kpis in KPI_STRUCTURE.values() for name in kpis.values()],
+    'Неделя_Год': [],
+    'Промежуток_Дат': [],
+}
+
+
+def mark_validated(df):
+    """Помечает DataFrame как прошедший проверку по текущей схеме."""
+    df.attrs['schema_version'] = SCHEMA_VERSION
+    return df
+
+
+def is_validated(df):
+    """Таблица помечена текущей схемой и ее колонки действительно имеют внутренние типы."""
+    if not isinstance(df, pd.DataFrame) or df.attrs.get('schema_version') != SCHEMA_VERSION:
+        return False
+    if any(col not in df.columns for col in REQUIRED_COLUMNS):
+        return False
+    dtypes = df.dtypes
+    return (dtypes['Дата_Начала'] == 'datetime64[ns]'
+            and all(dtypes[col] == 'float64' for col in NUMERICAL_COLUMNS)
+            and all(isinstance(dtypes[col], pd.CategoricalDtype) for col in CATEGORY_COLUMNS))
+
+
+def as_category(values, known=()):
+    """Категориальная колонка: известные значения плюс встреченные в данных."""
+    known = list(known)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        seen = values.cat.remove_unused_categories().cat.categories
+    else:
+        seen = pd.unique(values.dropna())
+    extra = sorted(set(seen) - set(known), key=str)
+    return values.astype(pd.CategoricalDtype(known + extra))
+
+
+def apply_schema_types(df):
+    """Приводит колонки к внутренним типам: datetime64[ns] для даты, float64 для чисел, категории для строк.
+
+    Числа остаются float64: суммы в рублях (SMM.MONEY, KPI.НП.2) не помещаются в точность float32.
+    """
+    df['Дата_Начала'] = pd.to_datetime(df['Дата_Начала'], errors='coerce').dt.normalize().astype('datetime64[ns]')
+    for col in NUMERICAL_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    for col, known in CATEGORY_COLUMNS.items():
+        df[col] = as_category(df[col], known)
+    return df
+
+
+def clean_data_types(df):
+    """Обеспечивает корректность типов данных и удаляет только критически некорректные строки.
+    Не удаляем строки при отсутствии одного из числовых полей — это было причиной потери всей БД.
+    Уже проверенная таблица (см. is_validated) возвращается как есть.
+    """
+    if is_validated(df):
+        return df
+
+    if not isinstance(df, pd.DataFrame) or df.empty or 'Дата_Начала' not in df.columns:
+        # Пустой или неполный вход — возвращаем корректно структурированную пустую DF
+        return mark_validated(apply_schema_types(pd.DataFrame(columns=REQUIRED_COLUMNS)))
+
+    # Удаляем только строки, где отсутствует KPI_ID или Название — эти поля критичны.
+    df = df.dropna(subset=['KPI_ID', 'Название'])
+
+    # Сбрасываем индекс (чтобы избежать проблем с неправильными индексами после редактирования)
+    df = df.reset_index(drop=True)
+
+    # Убедимся, что все нужные колонки присутствуют (добавим отсутствующие с NaN/пустотой)
+    for c in REQUIRED_COLUMNS:
+        if c not in df.columns:
+            df[c] = pd.NA
+
+    # Приведение типов (дата, числа без удаления строк с NaN, категории)
+    return mark_validated(apply_schema_types(df))
+
+
+def to_display_types(df):
+    """Типы для показа в st.data_editor: категории — строки, даты — Python date.
+
+    Результат уже не в типах схемы — отметку проверки (скопированную pandas из df) снимаем.
+    """
+    out = df.astype({col: object for col in CATEGORY_COLUMNS if col in df.columns})
+    out['Дата_Начала'] = out['Дата_Начала'].dt.date
+    out.attrs = {}
+    return out
+
+
+def _group_values(df, keys):
+    """Минимум/Цель/Факт по ключам группировки с функцией агрегации KPI (сумма или среднее)."""
+    grouped = df.groupby(keys, observed=True)[NUMERICAL_COLUMNS]
+    totals = pd.concat([grouped.sum().add_suffix('_sum'), grouped.count().add_suffix('_n')], axis=1)
+    return totals_to_values(totals, totals.index.get_level_values('Название')).reset_index()
+
+
+def filter_data_by_period(df, period_type, selected_month_str=None):
+    """Фильтрует и группирует данные: по месяцам (для Года) или по неделям (для Месяца).
+
+    Значение за период — сумма или среднее по функции KPI (см. totals_to_values).
+    """
+    # В очищенной таблице даты уже datetime64 — приводим только «сырые» входы
+    dates = df['Дата_Начала']
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors='coerce')
+
+    # КРИТИЧЕСКИЙ ФИЛЬТР: Отбрасываем строки, где нет даты или названия
+    valid = dates.notna() & df['Название'].notna()
+    if not valid.any():
+        return pd.DataFrame()
+
+    # 2. Фильтрация и группировка
+    if period_type == "Год (по месяцам)":
+
+        # Ключ для группировки и сортировки — месяц как Period (без strftime по каждой строке)
+        period_key = dates[valid].dt.to_period('M').rename('Period_Key')
+
+        # Группируем по ключу периода и Названию KPI (результат уже отсортирован по ключу)
+        df_grouped = _group_values(df.loc[valid], [period_key, df.loc[valid, 'Название']])
+
+        # Метка для оси X (Январь 2024) — считаем по сгруппированным строкам
+        df_grouped['Период'] = df_grouped['Period_Key'].dt.strftime('%B %Y')
+
+    else:  # Месяц (по неделям)
+        if selected_month_str is None:
+            return pd.DataFrame()
+
+        y, m = map(int, selected_month_str.split('-'))
+
+        # Фильтрация по году и месяцу
+        in_month = valid & (dates.dt.year == y) & (dates.dt.month == m)
+        if not in_month.any():
+            return pd.DataFrame()
+
+        # Группировка по уже существующим надежным строковым колонкам
+        week_cols = ['Неделя_Год', 'Промежуток_Дат', 'Название']
+        df_grouped = _group_values(df.loc[in_month, week_cols + NUMERICAL_COLUMNS], week_cols)
+        df_grouped['Период'] = df_grouped['Промежуток_Дат'].astype(str)
+
+    df_grouped['Название'] = df_grouped['Название'].astype(str)
+
+    # Возвращаем только необходимые для графика колонки
+    return df_grouped[['Название', 'Минимум', 'Цель', 'Факт', 'Период']]
+
+
+def filter_weeks_by_month(df):
+    """«Месяц (по неделям)» сразу для всех месяцев: один groupby по истории вместо маски на каждый месяц.
+
+    Возвращает {ГГГГ-ММ: агрегат} в порядке месяцев; агрегат каждого месяца тот же, что
+    filter_data_by_period(df, "Месяц (по неделям)", месяц).
+    """
+    dates = df['Дата_Начала']
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors='coerce')
+    valid = dates.notna() & df['Название'].notna()
+    if not valid.any():
+        return {}
+
+    rows = df.loc[valid]
+    month_key = dates[valid].dt.to_period('M').rename('Месяц')
+    df_grouped = _group_values(rows, [month_key, rows['Неделя_Год'], rows['Промежуток_Дат'], rows['Название']])
+    df_grouped['Период'] = df_grouped['Промежуток_Дат'].astype(str)
+    df_grouped['Название'] = df_grouped['Название'].astype(str)
+
+    columns = ['Название', 'Минимум', 'Цель', 'Факт', 'Период']
+    return {month.strftime('%Y-%m'): part[columns].reset_index(drop=True)
+            for month, part in df_grouped.groupby('Месяц', sort=True)}
+
+
+# --- ЗАПРОСЫ ПО ПЕРИОДАМ ---
+# Движок строится на «итогах»: суммы и количества непустых значений по (дата, KPI). Их дает
+# period_totals() по таблице истории или KPIStore.period_totals() по предагрегату rollup_date,
+# а aggregate_periods() за один groupby по всем KPI сворачивает их в нужную гранулярность.
+
+GRANULARITIES = {
+    "week": "W-SUN",  # недели пн–вс
+    "month": "M",
+    "quarter": "Q",
+    "year": "Y",
+}
+
+TOTAL_COLUMNS = [f"{col}_{part}" for col in NUMERICAL_COLUMNS for part in ("sum", "n")]
+
+
+# Функция агрегации KPI по его Названию (KPI_AGGREGATION в kpi_config задана по KPI_ID)
+_AGGREGATION_BY_NAME = {name: KPI_AGGREGATION.get(kpi_id, DEFAULT_AGGREGATION)
+                        for kpis in KPI_STRUCTURE.values() for kpi_id, name in kpis.items()}
+
+
+def totals_to_values(totals, names):
+    """Минимум/Цель/Факт из итогов {колонка}_sum / {колонка}_n: сумма для KPI с функцией "sum",
+    иначе среднее; без непустых значений — NaN. names — Названия KPI по строкам totals."""
+    names = pd.Index(names)
+    is_sum = names.isin([name for name, how in _AGGREGATION_BY_NAME.items() if how == "sum"])
+    if DEFAULT_AGGREGATION == "sum":
+        is_sum |= ~names.isin(list(_AGGREGATION_BY_NAME))
+    values = pd.DataFrame(index=totals.index)
+    for col in NUMERICAL_COLUMNS:
+        sums = totals[f"{col}_sum"].to_numpy(dtype=float)
+        counts = totals[f"{col}_n"].to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values[col] = np.where(counts > 0, np.where(is_sum, sums, sums / counts), np.nan)
+    return values
+
+
+def period_totals(df):
+    """Итоги по (Дата_Начала, Название): {колонка}_sum и {колонка}_n для Минимум/Цель/Факт."""
+    dates = df['Дата_Начала']
+    if not pd.api.types.is_datetime64_any_dtype(dates):
+        dates = pd.to_datetime(dates, errors='coerce')
+    valid = dates.notna() & df['Название'].notna()
+    keys = [dates[valid].rename('Дата_Начала'), df.loc[valid, 'Название']]
+    grouped = df.loc[valid, NUMERICAL_COLUMNS].groupby(keys, sort=False, observed=True)
+    totals = pd.concat([grouped.sum().add_suffix('_sum'), grouped.count().add_suffix('_n')], axis=1)
+    totals = totals[TOTAL_COLUMNS].reset_index()
+    totals['Название'] = totals['Название'].astype(str)
+    return totals
+
+
+def _period_labels(periods, granularity, window=None):
+    """Подписи периодов для оси X — форматируются по уникальным периодам."""
+    if granularity == "week" and window:
+        return (f"{window} нед. до " + periods.end_time.strftime('%d.%m.%Y'))
+    if granularity == "week":
+        return periods.start_time.strftime('%d.%m.%Y') + ' - ' + periods.end_time.strftime('%d.%m.%Y')
+    if granularity == "quarter":
+        return periods.strftime('%q кв. %Y')
+    if granularity == "year":
+        return periods.strftime('%Y')
+    return periods.strftime('%B %Y')
+
+
+def aggregate_periods(totals, granularity="month", window=None, yoy=False, start=None, end=None,
+                      kpi_names=None):
+    """Агрегаты KPI по периодам из итогов period_totals().
+
+    granularity — "week", "month", "quarter" или "year"; window=N (только для недель) — скользящее
+    окно из N календарных недель. Значение за период — сумма или среднее по функции KPI
+    (totals_to_values). yoy=True добавляет Факт за тот же период прошлого года (Факт_ПГ) и
+    изменение к нему в процентах. start/end ограничивают результат по началу периода.
+
+    Возвращает колонки Название, Минимум, Цель, Факт, Период (подпись), Начало_Периода,
+    отсортированные по периоду и названию — формат render_chart.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Неизвестная гранулярность: {granularity}")
+    if window and granularity != "week":
+        raise ValueError("Скользящее окно задается в неделях (granularity='week')")
+    columns = ['Название', 'Минимум', 'Цель', 'Факт', 'Период', 'Начало_Периода']
+    if yoy:
+        columns += ['Факт_ПГ', 'Изменение_ПГ_%']
+
+    if kpi_names is not None:
+        totals = totals[totals['Название'].isin(list(kpi_names))]
+    if totals.empty:
+        return pd.DataFrame(columns=columns)
+
+    freq = GRANULARITIES[granularity]
+    key = totals['Дата_Начала'].dt.to_period(freq).rename('Период_Ключ')
+    grouped = totals[TOTAL_COLUMNS].groupby([key, totals['Название']], sort=True).sum()
+
+    if window:
+        # Сплошная сетка недель × KPI: окно считается по календарным неделям, а не по строкам
+        wide = grouped.unstack('Название', fill_value=0)
+        weeks = pd.period_range(wide.index.min(), wide.index.max(), freq=freq, name='Период_Ключ')
+        wide = wide.reindex(weeks, fill_value=0).rolling(int(window), min_periods=1).sum()
+        grouped = wide.stack('Название', future_stack=True)
+        grouped = grouped[grouped[[f"{col}_n" for col in NUMERICAL_COLUMNS]].sum(axis=1) > 0]
+
+    names = grouped.index.get_level_values('Название')
+    result = totals_to_values(grouped, names)
+
+    periods = grouped.index.get_level_values('Период_Ключ')
+    unique = pd.PeriodIndex(periods.unique())
+    if yoy:
+        # Тот же период прошлого года — по календарю (начало периода минус год), а не сдвигом на
+        # 52 недели: иначе неделя уезжает на день в год и на целую неделю после 53-недельного года
+        prev_period = pd.Series((unique.start_time - pd.DateOffset(years=1)).to_period(freq), index=unique)
+        prev_keys = pd.MultiIndex.from_arrays([prev_period.reindex(periods).to_numpy(), names])
+        prev = result['Факт'].reindex(prev_keys).to_numpy()
+        result['Факт_ПГ'] = prev
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result['Изменение_ПГ_%'] = (result['Факт'].to_numpy() - prev) / np.abs(prev) * 100
+
+    labels = pd.Series(np.asarray(_period_labels(unique, granularity, window)), index=unique)
+    starts = pd.Series(unique.start_time, index=unique)
+    result['Период'] = labels.reindex(periods).to_numpy()
+    result['Начало_Периода'] = starts.reindex(periods).to_numpy()
+    result = result.reset_index(level='Название')
+
+    keep = np.ones(len(result), dtype=bool)
+    if start is not None:
+        keep &= result['Начало_Периода'] >= pd.Timestamp(start)
+    if end is not None:
+        keep &= result['Начало_Периода'] <= pd.Timestamp(end)
+    return result.loc[keep, columns].reset_index(drop=True)
+
+
+def query_periods(df, granularity="month", window=None, yoy=False, start=None, end=None, kpi_names=None):
+    """aggregate_periods() прямо по таблице истории (без базы)."""
+    return aggregate_periods(period_totals(df), granularity, window=window, yoy=yoy, start=start, end=end,
+                             kpi_names=kpi_names)
+
+
+# --- СТАТУСЫ KPI ---
+# Светофор по каждой ячейке (KPI, период): красный — Факт хуже Минимума, желтый — между Минимумом
+# и Целью, зеленый — Цель достигнута. Если Цель меньше Минимума (KPI.ФИН.1, KPI.HR.1), KPI
+# «чем меньше, тем лучше», и сравнения переворачиваются.
+STATUS_RED, STATUS_YELLOW, STATUS_GREEN = 0, 1, 2
+STATUS_LABELS = {STATUS_RED: "Ниже минимума", STATUS_YELLOW: "Между минимумом и целью",
+                 STATUS_GREEN: "Цель достигнута"}
+
+
+def kpi_status(minimum, target, fact):
+    """Статусы для массивов Минимум/Цель/Факт одним векторным проходом.
+
+    Возвращает float-массив: 0 — красный, 1 — желтый, 2 — зеленый, NaN — нет факта или порогов.
+    """
+    minimum = np.asarray(minimum, dtype=float)
+    target = np.asarray(target, dtype=float)
+    fact = np.asarray(fact, dtype=float)
+    # Для «меньше — лучше» меняем знак у всех трех значений: тогда условия одинаковые
+    sign = np.where(target < minimum, -1.0, 1.0)
+    fact_s, min_s, target_s = fact * sign, minimum * sign, target * sign
+    status = np.where(fact_s >= target_s, STATUS_GREEN, np.where(fact_s >= min_s, STATUS_YELLOW, STATUS_RED))
+    status = status.astype(float)
+    status[np.isnan(fact) | np.isnan(minimum) | np.isnan(target)] = np.nan
+    return status
+
+
+def _kpi_order(names):
+    """Названия KPI в порядке KPI_STRUCTURE, неизвестные — в конце."""
+    order = [name for kpis in KPI_STRUCTURE.values() for name in kpis.values()]
+    present = set(names)
+    return [n for n in order if n in present] + sorted(present.difference(order))
+
+
+def status_table(df_grouped):
+    """Матрицы статусов и фактов KPI × период для агрегата (формат filter_data_by_period / rollup).
+
+    Возвращает (status, fact): DataFrame с KPI по строкам (порядок KPI_STRUCTURE) и периодами
+    по столбцам (порядок агрегата). Пустые ячейки — NaN.
+    """
+    if df_grouped.empty:
+        empty = pd.DataFrame()
+        return empty, empty
+    names = df_grouped['Название'].astype(str)
+    periods = df_grouped['Период'].astype(str)
+    cells = pd.DataFrame({
+        'Название': names.to_numpy(),
+        'Период': periods.to_numpy(),
+        'Статус': kpi_status(df_grouped['Минимум'], df_grouped['Цель'], df_grouped['Факт']),
+        'Факт': df_grouped['Факт'].to_numpy(dtype=float),
+    })
+    rows, cols = _kpi_order(names.unique()), periods.unique().tolist()
+    status = cells.pivot_table(index='Название', columns='Период', values='Статус', aggfunc='last', dropna=False)
+    fact = cells.pivot_table(index='Название', columns='Период', values='Факт', aggfunc='last', dropna=False)
+    return status.reindex(index=rows, columns=cols), fact.reindex(index=rows, columns=cols)
+
+
+def status_alerts(df_grouped, statuses=(STATUS_RED,)):
+    """KPI, у которых в последнем периоде с фактом статус из statuses (по умолчанию — красный).
+
+    Возвращает строки агрегата с колонкой Статус, худшие сверху.
+    """
+    if df_grouped.empty:
+        return pd.DataFrame(columns=['Название', 'Период', 'Минимум', 'Цель', 'Факт', 'Статус'])
+    cells = df_grouped[['Название', 'Период', 'Минимум', 'Цель', 'Факт']]
+    cells = cells.assign(Статус=kpi_status(cells['Минимум'], cells['Цель'], cells['Факт']))
+    latest = cells[cells['Статус'].notna()].groupby('Название', sort=False, observed=True).tail(1)
+    alerts = latest[latest['Статус'].isin(statuses)]
+    order = {name: i for i, name in enumerate(_kpi_order(alerts['Название'].astype(str).unique()))}
+    return (alerts.assign(_order=alerts['Название'].astype(str).map(order))
+            .sort_values(['Статус', '_order']).drop(columns='_order').reset_index(drop=True))
+
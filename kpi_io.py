@@ -0,0 +1,351 @@
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from kpi_config import KPI_STRUCTURE, REQUIRED_COLUMNS
+from kpi_data import NUMERICAL_COLUMNS, clean_data_types, get_week_info_vectorized, mark_validated
+from kpi_store import UPSERT_KEY
+
+# --- ИМПОРТ ИСТОРИИ ИЗ CSV / EXCEL ---
+# Файл читается кусками по IMPORT_CHUNK_ROWS строк (openpyxl — в режиме read_only), каждый кусок
+# проверяется векторно и сразу записывается в базу, поэтому память не зависит от размера файла.
+# Модуль не зависит от Streamlit: прогресс передается через обратный вызов.
+
+IMPORT_CHUNK_ROWS = 5000
+# Сколько отклоненных строк сохранять в отчете для показа (остальные только считаются)
+MAX_REJECTED_SAMPLE = 200
+
+# Колонки, которые импорт всегда заполняет сам (по Дата_Начала и KPI_ID); остальные берутся из файла
+_DERIVED_COLUMNS = ["Дата_Начала", "Неделя_Год", "Промежуток_Дат", "Категория", "KPI_ID", "Название"]
+
+_KPI_NAMES = {kpi_id: name for kpis in KPI_STRUCTURE.values() for kpi_id, name in kpis.items()}
+_KPI_CATEGORIES = {kpi_id: category for category, kpis in KPI_STRUCTURE.items() for kpi_id in kpis}
+
+
+def _file_kind(source, filename=None):
+    name = filename or getattr(source, "name", None) or (source if isinstance(source, str) else "")
+    ext = os.path.splitext(str(name))[1].lower()
+    if ext in (".xlsx", ".xlsm"):
+        return "xlsx"
+    if ext in (".csv", ".txt", ""):
+        return "csv"
+    raise ValueError(f"Неподдерживаемый формат файла: {ext} (нужен CSV или XLSX)")
+
+
+def _count_csv_rows(source):
+    """Число строк данных в CSV (для прогресса) — подсчет переводов строк блоками, без разбора."""
+    f = open(source, "rb") if isinstance(source, str) else source
+    try:
+        f.seek(0)
+        total = sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b""))
+    finally:
+        if isinstance(source, str):
+            f.close()
+    return max(total - 1, 0) or None
+
+
+def _sniff_csv(source):
+    """Разделитель и кодировка по началу файла.
+
+    Оба определяются по строке заголовка. Разделитель: «,» (выгрузка истории) или «;» (CSV из
+    русского Excel). Кодировка: UTF-8 (с BOM или без), а если заголовок (в нем русские названия
+    колонок) в UTF-8 не читается — cp1251, в которой русский Excel сохраняет CSV.
+    """
+    f = open(source, "rb") if isinstance(source, str) else source
+    try:
+        f.seek(0)
+        header = f.readline()
+    finally:
+        if isinstance(source, str):
+            f.close()
+    sep = ";" if header.count(b";") > header.count(b",") else ","
+    try:
+        header.decode("utf-8")
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "cp1251"
+    return sep, encoding
+
+
+def _read_csv_chunks(source, chunksize):
+    sep, encoding = _sniff_csv(source)
+    if not isinstance(source, str):
+        source.seek(0)
+    try:
+        with pd.read_csv(source, chunksize=chunksize, dtype=str, encoding=encoding, sep=sep) as reader:
+            yield from reader
+    except UnicodeDecodeError as e:
+        raise ValueError(f"Текст файла не читается ({encoding}, {e.reason}): сохраните CSV в кодировке UTF-8")
+    except pd.errors.ParserError as e:
+        raise ValueError(f"Файл не читается как CSV: {e}")
+
+
+def _open_workbook(source, **kwargs):
+    """Книга openpyxl; поврежденный или не-XLSX файл — ValueError с понятным сообщением."""
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    if not isinstance(source, str):
+        source.seek(0)
+    try:
+        return load_workbook(source, read_only=True, **kwargs)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError, OSError) as e:
+        raise ValueError(f"Файл не читается как книга Excel (.xlsx): {e}")
+
+
+def _read_xlsx_chunks(source, chunksize):
+    """Все листы книги, в заголовке которых есть Дата_Начала и KPI_ID (например, отчет по категориям).
+
+    Если таких листов нет — ValueError: иначе импорт «успешно» загрузил бы 0 строк.
+    """
+    workbook = _open_workbook(source, data_only=True)
+    matched = 0
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if not header:
+                continue
+            header = [str(h).strip() if h is not None else "" for h in header]
+            if "Дата_Начала" not in header or "KPI_ID" not in header:
+                continue
+            matched += 1
+            batch = []
+            for row in rows:
+                if any(v is not None for v in row):
+                    batch.append(row[:len(header)])
+                if len(batch) >= chunksize:
+                    yield pd.DataFrame(batch, columns=header)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+    if not matched:
+        raise ValueError("В книге нет листа с колонками Дата_Начала и KPI_ID в первой строке")
+
+
+def _count_xlsx_rows(source):
+    """Число строк по размерам листов из метаданных книги (без чтения ячеек); None — если неизвестно."""
+    workbook = _open_workbook(source)
+    try:
+        sizes = [sheet.max_row for sheet in workbook.worksheets]
+    finally:
+        workbook.close()
+    if any(size is None for size in sizes):
+        return None
+    return sum(max(size - 1, 0) for size in sizes) or None
+
+
+def read_chunks(source, filename=None, chunksize=IMPORT_CHUNK_ROWS):
+    """Читает CSV/XLSX (путь или файловый объект, например st.file_uploader) кусками DataFrame."""
+    if _file_kind(source, filename) == "xlsx":
+        return _read_xlsx_chunks(source, chunksize)
+    return _read_csv_chunks(source, chunksize)
+
+
+def _parse_dates(values):
+    """Даты из ISO (как в выгрузке CSV), ДД.ММ.ГГГГ или ячеек Excel."""
+    parsed = pd.to_datetime(values, errors="coerce", format="ISO8601")
+    missing = parsed.isna() & values.notna()
+    if missing.any():
+        parsed[missing] = pd.to_datetime(values[missing].astype(str).str.strip(), errors="coerce",
+                                         format="%d.%m.%Y")
+    return parsed
+
+
+def _parse_numbers(values):
+    """Числа, в том числе с запятой как десятичным разделителем и пробелами между разрядами."""
+    if values.dtype == object or pd.api.types.is_string_dtype(values):
+        values = values.astype(str).str.replace("\u00a0", "", regex=False).str.replace(" ", "", regex=False)
+        values = values.str.replace(",", ".", regex=False)
+    return pd.to_numeric(values, errors="coerce")
+
+
+def prepare_chunk(chunk):
+    """Проверяет и нормализует кусок импорта целиком (векторно).
+
+    Неделя и диапазон дат пересчитываются по Дата_Начала, Название и Категория берутся из
+    KPI_STRUCTURE по KPI_ID. Возвращает (очищенные строки, отклоненные строки с колонкой Причина).
+    """
+    chunk = chunk.rename(columns=lambda c: str(c).strip())
+    missing = [c for c in ("Дата_Начала", "KPI_ID") if c not in chunk.columns]
+    if missing:
+        raise ValueError(f"В файле нет обязательных колонок: {', '.join(missing)}")
+    chunk = chunk.reset_index(drop=True)
+
+    kpi_ids = chunk["KPI_ID"].astype("string").str.strip()
+    dates = _parse_dates(chunk["Дата_Начала"])
+    known_kpi = kpi_ids.isin(list(_KPI_NAMES)).fillna(False).to_numpy(dtype=bool)
+    has_date = dates.notna().to_numpy()
+
+    reasons = np.full(len(chunk), "", dtype=object)
+    reasons[~has_date] = "Нет или неверная дата"
+    reasons[has_date & ~known_kpi] = "Неизвестный KPI_ID"
+    ok = has_date & known_kpi
+    rejected = chunk.loc[~ok].assign(Причина=reasons[~ok])
+
+    good = chunk.loc[ok]
+    starts, week_ids, date_ranges = get_week_info_vectorized(dates[ok])
+    ids = kpi_ids[ok]
+    out = pd.DataFrame({
+        "Дата_Начала": starts.to_numpy(),
+        "Неделя_Год": np.asarray(week_ids, dtype=object),
+        "Промежуток_Дат": np.asarray(date_ranges, dtype=object),
+        "Категория": ids.map(_KPI_CATEGORIES).to_numpy(dtype=object),
+        "KPI_ID": ids.to_numpy(dtype=object),
+        "Название": ids.map(_KPI_NAMES).to_numpy(dtype=object),
+    })
+    for col in NUMERICAL_COLUMNS:
+        out[col] = _parse_numbers(good[col]).to_numpy() if col in good.columns else np.nan
+    out["Комментарий"] = (good["Комментарий"].astype(object).where(good["Комментарий"].notna(), "").to_numpy()
+                         if "Комментарий" in good.columns else "")
+    return clean_data_types(out[REQUIRED_COLUMNS]), rejected
+
+
+def import_history(store, source, filename=None, chunksize=IMPORT_CHUNK_ROWS, progress=None):
+    """Потоковый импорт файла в базу: каждый проверенный кусок записывается через store.upsert.
+
+    Строки с тем же KPI за ту же неделю заменяют существующие (прежние значения — в журнале);
+    колонки Минимум/Цель/Факт/Комментарий, которых нет в файле, у существующих строк не меняются.
+    progress(прочитано_строк, всего_строк_или_None) вызывается после каждого куска.
+    Возвращает отчет: read, added, replaced, rejected и rejected_sample (первые отклоненные строки).
+    """
+    kind = _file_kind(source, filename)
+    total = _count_xlsx_rows(source) if kind == "xlsx" else _count_csv_rows(source)
+    report = {"read": 0, "added": 0, "replaced": 0, "rejected": 0}
+    samples, sampled = [], 0
+
+    for chunk in read_chunks(source, filename, chunksize):
+        cleaned, rejected = prepare_chunk(chunk)
+        # Существующим строкам переписываем только колонки из файла: отсутствующая в файле колонка
+        # (например, Цель или Комментарий) не должна затирать сохраненные значения
+        in_file = {str(c).strip() for c in chunk.columns}
+        update_columns = _DERIVED_COLUMNS + [c for c in REQUIRED_COLUMNS if c in in_file and c not in _DERIVED_COLUMNS]
+        # Повторы ключа внутри куска схлопываем заранее (выигрывает последняя строка, как и при upsert):
+        # каждая замена в базе — это триггеры предагрегатов и журнала
+        unique = mark_validated(cleaned.drop_duplicates(list(UPSERT_KEY), keep="last"))
+        added, replaced = store.upsert(unique, update_columns=update_columns)
+        replaced += len(cleaned) - len(unique)
+        report["read"] += len(chunk)
+        report["added"] += added
+        report["replaced"] += replaced
+        report["rejected"] += len(rejected)
+        if len(rejected) and sampled < MAX_REJECTED_SAMPLE:
+            samples.append(rejected.head(MAX_REJECTED_SAMPLE - sampled))
+            sampled += len(samples[-1])
+        if progress is not None:
+            progress(report["read"], total)
+
+    report["rejected_sample"] = pd.concat(samples, ignore_index=True) if samples else pd.DataFrame()
+    return report
+
+
+# --- ЭКСПОРТ ---
+# Файлы собираются только по запросу (кнопка скачивания) из базы кусками: полная история
+# в DataFrame для выгрузки не строится. Кэширование по версии данных — на стороне вызывающего.
+EXPORT_CHUNK_ROWS = 10000
+
+
+def export_csv(store, chunksize=EXPORT_CHUNK_ROWS):
+    """Бэкап всей истории в CSV (тот же формат, что читает import_history)."""
+    buf = io.BytesIO()
+    wrapper = io.TextIOWrapper(buf, encoding="utf-8", newline="")
+    header = True
+    for chunk in store.iter_history(chunksize):
+        chunk.to_csv(wrapper, index=False, header=header)
+        header = False
+    if header:
+        pd.DataFrame(columns=REQUIRED_COLUMNS).to_csv(wrapper, index=False)
+    wrapper.flush()
+    data = buf.getvalue()
+    wrapper.close()
+    return data
+
+
+def _sheet_name(category):
+    """Имя листа Excel: до 31 символа, без []:*?/\\."""
+    name = "".join("_" if ch in '[]:*?/\\' else ch for ch in category)
+    return name[:31]
+
+
+def export_report_xlsx(store, chunksize=EXPORT_CHUNK_ROWS):
+    """Управленческий отчет XLSX: лист на каждую категорию KPI_STRUCTURE, Факт подсвечен
+    относительно Минимума и Цели (как kpi_status, с учетом KPI «меньше — лучше»).
+
+    Пишется в режиме constant_memory: строки сбрасываются на диск по мере записи, поэтому память
+    не растет с размером истории. Листы можно снова загрузить через import_history.
+    """
+    import xlsxwriter
+    from xlsxwriter.utility import xl_col_to_name
+
+    buf = io.BytesIO()
+    workbook = xlsxwriter.Workbook(buf, {"constant_memory": True, "default_date_format": "dd.mm.yyyy"})
+    header_fmt = workbook.add_format({"bold": True, "bg_color": "#dfe6ee", "border": 1, "text_wrap": True})
+    date_fmt = workbook.add_format({"num_format": "dd.mm.yyyy"})
+    number_fmt = workbook.add_format({"num_format": "#,##0.00"})
+    status_fmts = {
+        "green": workbook.add_format({"bg_color": "#c6efce", "font_color": "#006100"}),
+        "yellow": workbook.add_format({"bg_color": "#ffeb9c", "font_color": "#9c5700"}),
+        "red": workbook.add_format({"bg_color": "#ffc7ce", "font_color": "#9c0006"}),
+    }
+    widths = {"Дата_Начала": 12, "Неделя_Год": 11, "Промежуток_Дат": 24, "Категория": 20, "KPI_ID": 16,
+              "Название": 45, "Минимум": 12, "Цель": 12, "Факт": 12, "Комментарий": 40}
+
+    sheets, next_row = {}, {}
+    for category in KPI_STRUCTURE:
+        sheet = workbook.add_worksheet(_sheet_name(category))
+        for col_idx, col in enumerate(REQUIRED_COLUMNS):
+            sheet.set_column(col_idx, col_idx, widths.get(col, 14))
+            sheet.write_string(0, col_idx, col, header_fmt)
+        sheet.freeze_panes(1, 0)
+        sheets[category], next_row[category] = sheet, 1
+
+    # Один проход по истории: строки раскладываются по листам своих категорий
+    col_pos = {col: i for i, col in enumerate(REQUIRED_COLUMNS)}
+    number_cols = [col_pos[c] for c in NUMERICAL_COLUMNS]
+    for chunk in store.iter_history(chunksize, categories=list(KPI_STRUCTURE), by_kpi=True):
+        rows = chunk[REQUIRED_COLUMNS].to_numpy(dtype=object)
+        dates = chunk["Дата_Начала"].dt.to_pydatetime()
+        for values, start in zip(rows, dates):
+            category = values[col_pos["Категория"]]
+            sheet, r = sheets[category], next_row[category]
+            if pd.notna(start):
+                sheet.write_datetime(r, 0, start, date_fmt)
+            for c in range(1, len(REQUIRED_COLUMNS)):
+                value = values[c]
+                if value is None or (isinstance(value, float) and np.isnan(value)):
+                    continue
+                if c in number_cols:
+                    sheet.write_number(r, c, value, number_fmt)
+                else:
+                    sheet.write_string(r, c, str(value))
+            next_row[category] = r + 1
+
+    # Светофор по Факту: зеленый — цель достигнута, желтый — между минимумом и целью, красный — хуже минимума.
+    # Если Цель < Минимума, KPI «меньше — лучше», и сравнения переворачиваются.
+    fact = xl_col_to_name(col_pos["Факт"])
+    minimum = xl_col_to_name(col_pos["Минимум"])
+    target = xl_col_to_name(col_pos["Цель"])
+    f, m, t = f"${fact}2", f"${minimum}2", f"${target}2"
+    filled = f"ISNUMBER({f}),ISNUMBER({m}),ISNUMBER({t})"
+    rules = [
+        ("green", f"=AND({filled},IF({t}>={m},{f}>={t},{f}<={t}))"),
+        ("yellow", f"=AND({filled},IF({t}>={m},{f}>={m},{f}<={m}))"),
+        ("red", f"=AND({filled})"),
+    ]
+    for category, sheet in sheets.items():
+        last = next_row[category] - 1
+        if last < 1:
+            continue
+        sheet.autofilter(0, 0, last, len(REQUIRED_COLUMNS) - 1)
+        cells = f"{fact}2:{fact}{last + 1}"
+        for color, formula in rules:
+            sheet.conditional_format(cells, {"type": "formula", "criteria": formula, "format": status_fmts[color],
+                                             "stop_if_true": True})
+
+    workbook.close()
+    return buf.getvalue()
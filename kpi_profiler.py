@@ -0,0 +1,70 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# --- ДИАГНОСТИКА ПЕРЕЗАПУСКОВ ---
+# Замеры этапов одного выполнения скрипта Streamlit: время, обработанные строки и объем данных,
+# отправленных в браузер. Включается переключателем в боковой панели или BBDASHBOARD_PROFILE=1.
+
+
+class RerunProfiler:
+    """Собирает этапы одного перезапуска. В выключенном состоянии stage() почти ничего не стоит."""
+
+    def __init__(self, enabled=False, log_path=None, session_id=None):
+        self.enabled = enabled
+        self.log_path = log_path
+        self.session_id = session_id
+        self.stages = []
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, rows=None, nbytes=None):
+        """Замер этапа. Внутри блока в выданный dict можно дописать rows/bytes и другие поля."""
+        record = {"stage": name, "rows": rows, "bytes": nbytes}
+        if not self.enabled:
+            yield record
+            return
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["ms"] = round((time.perf_counter() - start) * 1000, 3)
+            self.stages.append(record)
+
+    def total_ms(self):
+        return round((time.perf_counter() - self._started) * 1000, 3)
+
+    def flush(self, **context):
+        """Дописывает перезапуск одной строкой в JSONL-журнал метрик."""
+        if not self.enabled or not self.log_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.log_path)), exist_ok=True)
+        line = {
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "session": self.session_id,
+            "total_ms": self.total_ms(),
+            **context,
+            "stages": self.stages,
+        }
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(line, ensure_ascii=False, default=str) + "\n")
+
+
+def figure_bytes(fig):
+    """Размер JSON фигуры Plotly — столько уходит в браузер за один график."""
+    return len(fig.to_json())
+
+
+def frame_bytes(df):
+    """Размер таблицы в формате Arrow (так Streamlit передает DataFrame в браузер)."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return int(df.memory_usage(deep=True).sum())
+    table = pa.Table.from_pandas(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().size
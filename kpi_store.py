@@ -0,0 +1,652 @@
+import os
+import pathlib
+import sqlite3
+import threading
+
+import pandas as pd
+
+from kpi_config import REQUIRED_COLUMNS
+from kpi_data import (NUMERICAL_COLUMNS, TOTAL_COLUMNS, aggregate_periods, apply_schema_types,
+                      clean_data_types, mark_validated, totals_to_values)
+
+# --- ХРАНИЛИЩЕ KPI (SQLite) ---
+# Одна база на процесс: все сессии Streamlit пишут и читают через один объект KPIStore,
+# данные переживают перезапуск приложения.
+
+TABLE = "kpi_history"
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {TABLE} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    "Дата_Начала" TEXT,
+    "Неделя_Год" TEXT,
+    "Промежуток_Дат" TEXT,
+    "Категория" TEXT,
+    "KPI_ID" TEXT NOT NULL,
+    "Название" TEXT NOT NULL,
+    "Минимум" REAL,
+    "Цель" REAL,
+    "Факт" REAL,
+    "Комментарий" TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_{TABLE}_date ON {TABLE} ("Дата_Начала");
+CREATE INDEX IF NOT EXISTS idx_{TABLE}_kpi ON {TABLE} ("KPI_ID", "Дата_Начала");
+CREATE INDEX IF NOT EXISTS idx_{TABLE}_category ON {TABLE} ("Категория", "Дата_Начала");
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+"""
+
+# --- ПРЕДАГРЕГАТЫ (ROLLUPS) ---
+# Суммы и количества непустых значений по (период, KPI). Среднее = сумма / количество,
+# поэтому вставка, правка и удаление строки меняют агрегат за O(1), без пересчета истории.
+# Поддерживаются триггерами, т.е. любым путем записи в kpi_history.
+# rollup_date — те же итоги по точной дате: из них собираются любые периоды (aggregate_periods).
+# Список месяцев для выбора — ключи rollup_month, отдельной таблицы для него не нужно.
+ROLLUP_SCHEMA_VERSION = 4
+
+_ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rollup_month (
+    period TEXT NOT NULL,
+    name TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    min_sum REAL NOT NULL, min_n INTEGER NOT NULL,
+    target_sum REAL NOT NULL, target_n INTEGER NOT NULL,
+    fact_sum REAL NOT NULL, fact_n INTEGER NOT NULL,
+    PRIMARY KEY (period, name)
+);
+CREATE TABLE IF NOT EXISTS rollup_week (
+    month TEXT NOT NULL,
+    week TEXT NOT NULL,
+    date_range TEXT NOT NULL,
+    name TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    min_sum REAL NOT NULL, min_n INTEGER NOT NULL,
+    target_sum REAL NOT NULL, target_n INTEGER NOT NULL,
+    fact_sum REAL NOT NULL, fact_n INTEGER NOT NULL,
+    PRIMARY KEY (month, week, date_range, name)
+);
+CREATE TABLE IF NOT EXISTS rollup_date (
+    date TEXT NOT NULL,
+    name TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    min_sum REAL NOT NULL, min_n INTEGER NOT NULL,
+    target_sum REAL NOT NULL, target_n INTEGER NOT NULL,
+    fact_sum REAL NOT NULL, fact_n INTEGER NOT NULL,
+    PRIMARY KEY (date, name)
+);
+"""
+
+# Вклад одной строки (NEW/OLD) в агрегат
+_VALUES = """1,
+    COALESCE({r}."Минимум", 0), {r}."Минимум" IS NOT NULL,
+    COALESCE({r}."Цель", 0), {r}."Цель" IS NOT NULL,
+    COALESCE({r}."Факт", 0), {r}."Факт" IS NOT NULL"""
+
+_ADD = """
+INSERT INTO rollup_month (period, name, rows, min_sum, min_n, target_sum, target_n, fact_sum, fact_n)
+SELECT substr({r}."Дата_Начала", 1, 7), {r}."Название", """ + _VALUES + """
+WHERE {r}."Дата_Начала" IS NOT NULL
+ON CONFLICT (period, name) DO UPDATE SET
+    rows = rows + 1,
+    min_sum = min_sum + excluded.min_sum, min_n = min_n + excluded.min_n,
+    target_sum = target_sum + excluded.target_sum, target_n = target_n + excluded.target_n,
+    fact_sum = fact_sum + excluded.fact_sum, fact_n = fact_n + excluded.fact_n;
+INSERT INTO rollup_week (month, week, date_range, name, rows, min_sum, min_n, target_sum, target_n, fact_sum, fact_n)
+SELECT substr({r}."Дата_Начала", 1, 7), {r}."Неделя_Год", {r}."Промежуток_Дат", {r}."Название", """ + _VALUES + """
+WHERE {r}."Дата_Начала" IS NOT NULL AND {r}."Неделя_Год" IS NOT NULL AND {r}."Промежуток_Дат" IS NOT NULL
+ON CONFLICT (month, week, date_range, name) DO UPDATE SET
+    rows = rows + 1,
+    min_sum = min_sum + excluded.min_sum, min_n = min_n + excluded.min_n,
+    target_sum = target_sum + excluded.target_sum, target_n = target_n + excluded.target_n,
+    fact_sum = fact_sum + excluded.fact_sum, fact_n = fact_n + excluded.fact_n;
+INSERT INTO rollup_date (date, name, rows, min_sum, min_n, target_sum, target_n, fact_sum, fact_n)
+SELECT {r}."Дата_Начала", {r}."Название", """ + _VALUES + """
+WHERE {r}."Дата_Начала" IS NOT NULL
+ON CONFLICT (date, name) DO UPDATE SET
+    rows = rows + 1,
+    min_sum = min_sum + excluded.min_sum, min_n = min_n + excluded.min_n,
+    target_sum = target_sum + excluded.target_sum, target_n = target_n + excluded.target_n,
+    fact_sum = fact_sum + excluded.fact_sum, fact_n = fact_n + excluded.fact_n;
+"""
+
+_SUBTRACT_SET = """rows = rows - 1,
+    min_sum = min_sum - COALESCE({r}."Минимум", 0), min_n = min_n - ({r}."Минимум" IS NOT NULL),
+    target_sum = target_sum - COALESCE({r}."Цель", 0), target_n = target_n - ({r}."Цель" IS NOT NULL),
+    fact_sum = fact_sum - COALESCE({r}."Факт", 0), fact_n = fact_n - ({r}."Факт" IS NOT NULL)"""
+
+_SUBTRACT = """
+UPDATE rollup_month SET """ + _SUBTRACT_SET + """
+WHERE period = substr({r}."Дата_Начала", 1, 7) AND name = {r}."Название";
+DELETE FROM rollup_month WHERE period = substr({r}."Дата_Начала", 1, 7) AND name = {r}."Название" AND rows <= 0;
+UPDATE rollup_week SET """ + _SUBTRACT_SET + """
+WHERE month = substr({r}."Дата_Начала", 1, 7) AND week = {r}."Неделя_Год"
+    AND date_range = {r}."Промежуток_Дат" AND name = {r}."Название";
+DELETE FROM rollup_week WHERE month = substr({r}."Дата_Начала", 1, 7) AND week = {r}."Неделя_Год"
+    AND date_range = {r}."Промежуток_Дат" AND name = {r}."Название" AND rows <= 0;
+UPDATE rollup_date SET """ + _SUBTRACT_SET + """
+WHERE date = {r}."Дата_Начала" AND name = {r}."Название";
+DELETE FROM rollup_date WHERE date = {r}."Дата_Начала" AND name = {r}."Название" AND rows <= 0;
+"""
+
+# Колонки, от которых зависят агрегаты: правка комментария триггер не запускает
+_ROLLUP_COLUMNS = '"Дата_Начала", "Неделя_Год", "Промежуток_Дат", "Название", "Минимум", "Цель", "Факт"'
+
+_ROLLUP_TRIGGERS = (
+    f"CREATE TRIGGER IF NOT EXISTS trg_rollup_insert AFTER INSERT ON {TABLE} BEGIN"
+    + _ADD.format(r="NEW") + "END;\n"
+    + f"CREATE TRIGGER IF NOT EXISTS trg_rollup_delete AFTER DELETE ON {TABLE} BEGIN"
+    + _SUBTRACT.format(r="OLD") + "END;\n"
+    + f"CREATE TRIGGER IF NOT EXISTS trg_rollup_update AFTER UPDATE OF {_ROLLUP_COLUMNS} ON {TABLE} BEGIN"
+    + _SUBTRACT.format(r="OLD") + _ADD.format(r="NEW") + "END;\n"
+)
+
+_DROP_ROLLUP_TRIGGERS = """
+DROP TRIGGER IF EXISTS trg_rollup_insert;
+DROP TRIGGER IF EXISTS trg_rollup_delete;
+DROP TRIGGER IF EXISTS trg_rollup_update;
+"""
+
+_AGGREGATES = """COUNT(*),
+    TOTAL("Минимум"), COUNT("Минимум"), TOTAL("Цель"), COUNT("Цель"), TOTAL("Факт"), COUNT("Факт")"""
+
+_REBUILD_ROLLUPS = f"""
+DELETE FROM rollup_month;
+DELETE FROM rollup_week;
+INSERT INTO rollup_month
+SELECT substr("Дата_Начала", 1, 7), "Название", {_AGGREGATES}
+FROM {TABLE} WHERE "Дата_Начала" IS NOT NULL
+GROUP BY 1, 2;
+INSERT INTO rollup_week
+SELECT substr("Дата_Начала", 1, 7), "Неделя_Год", "Промежуток_Дат", "Название", {_AGGREGATES}
+FROM {TABLE} WHERE "Дата_Начала" IS NOT NULL AND "Неделя_Год" IS NOT NULL AND "Промежуток_Дат" IS NOT NULL
+GROUP BY 1, 2, 3, 4;
+DELETE FROM rollup_date;
+INSERT INTO rollup_date
+SELECT "Дата_Начала", "Название", {_AGGREGATES}
+FROM {TABLE} WHERE "Дата_Начала" IS NOT NULL
+GROUP BY 1, 2;
+DROP TABLE IF EXISTS period_index;
+"""
+
+
+# --- КЛЮЧ (KPI_ID, Неделя_Год) И ЖУРНАЛ ИЗМЕНЕНИЙ ---
+# Один KPI за неделю — одна строка: повторный ввод заменяет значение (upsert) поиском по
+# уникальному индексу, а прежние значения (правки и удаления) сохраняются в журнале.
+UPSERT_KEY = ("KPI_ID", "Неделя_Год")
+_UNIQUE_INDEX = f"idx_{TABLE}_kpi_week"
+AUDIT_TABLE = f"{TABLE}_audit"
+
+_AUDIT_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {AUDIT_TABLE} (
+    audit_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    row_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime')),
+    "Дата_Начала" TEXT,
+    "Неделя_Год" TEXT,
+    "Промежуток_Дат" TEXT,
+    "Категория" TEXT,
+    "KPI_ID" TEXT,
+    "Название" TEXT,
+    "Минимум" REAL,
+    "Цель" REAL,
+    "Факт" REAL,
+    "Комментарий" TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_{AUDIT_TABLE}_key ON {AUDIT_TABLE} ("KPI_ID", "Неделя_Год");
+"""
+
+_AUDIT_COLUMNS = ", ".join(f'"{c}"' for c in REQUIRED_COLUMNS)
+_OLD_VALUES = ", ".join(f'OLD."{c}"' for c in REQUIRED_COLUMNS)
+_CHANGED = " OR ".join(f'OLD."{c}" IS NOT NEW."{c}"' for c in REQUIRED_COLUMNS)
+
+_AUDIT_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS trg_audit_update AFTER UPDATE ON {TABLE} WHEN {_CHANGED} BEGIN
+    INSERT INTO {AUDIT_TABLE} (row_id, action, {_AUDIT_COLUMNS}) VALUES (OLD.id, 'update', {_OLD_VALUES});
+END;
+CREATE TRIGGER IF NOT EXISTS trg_audit_delete AFTER DELETE ON {TABLE} BEGIN
+    INSERT INTO {AUDIT_TABLE} (row_id, action, {_AUDIT_COLUMNS}) VALUES (OLD.id, 'delete', {_OLD_VALUES});
+END;
+"""
+
+_DROP_AUDIT_TRIGGERS = """
+DROP TRIGGER IF EXISTS trg_audit_update;
+DROP TRIGGER IF EXISTS trg_audit_delete;
+"""
+
+
+def _quote(col):
+    return f'"{col}"'
+
+
+def _statements(script):
+    """Делит SQL-скрипт на отдельные команды (тела триггеров не разрываются).
+
+    executescript() неявно коммитит открытую транзакцию, поэтому скрипты внутри
+    транзакций выполняются по одной команде.
+    """
+    buf = ""
+    for part in script.split(";"):
+        buf += part + ";"
+        if sqlite3.complete_statement(buf):
+            if buf.strip(" \n;"):
+                yield buf.strip()
+            buf = ""
+
+
+def _to_records(df):
+    """Переводит очищенный DataFrame в кортежи для executemany: даты — ISO-строки, NaN/NaT — NULL."""
+    df = df.reindex(columns=REQUIRED_COLUMNS)
+    out = df.astype(object)
+    out['Дата_Начала'] = df['Дата_Начала'].dt.strftime('%Y-%m-%d').astype(object)
+    out = out.where(pd.notna(out), None)
+    return list(out.itertuples(index=False, name=None))
+
+
+class KPIStore:
+    """Постоянное хранилище истории KPI.
+
+    Вставки добавляют строки или заменяют строку того же KPI за ту же неделю (без перезаписи
+    всей таблицы), чтение можно ограничить диапазоном дат. Каждая запись увеличивает счетчик
+    версии данных в таблице meta — он входит в ключи общих кэшей агрегатов, фигур и выгрузок.
+    """
+
+    def __init__(self, path):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # SQLite lower() понимает только ASCII — для поиска по русским комментариям берем Python
+        self._conn.create_function("py_lower", 1, lambda s: s.lower() if s is not None else None,
+                                   deterministic=True)
+        self._conn.executescript(_SCHEMA)
+        self._init_rollups()
+        self._init_upsert_key()
+
+    def _init_rollups(self):
+        """Создает предагрегаты; для базы без них (или старой схемы) пересчитывает их один раз."""
+        with self._lock:
+            self._begin()
+            try:
+                self._script(_ROLLUP_SCHEMA)
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'rollup_schema'").fetchone()
+                if row is None or row[0] != ROLLUP_SCHEMA_VERSION:
+                    self._script(_DROP_ROLLUP_TRIGGERS + _REBUILD_ROLLUPS)
+                    self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('rollup_schema', ?)",
+                                       (ROLLUP_SCHEMA_VERSION,))
+                self._script(_ROLLUP_TRIGGERS)
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _init_upsert_key(self):
+        """Журнал изменений и уникальный ключ (KPI_ID, Неделя_Год).
+
+        В базе, созданной до появления ключа, дубликаты схлопываются: остается последний ввод
+        (наибольший id), остальные строки удаляются и попадают в журнал.
+        """
+        with self._lock:
+            self._begin()
+            try:
+                self._script(_AUDIT_SCHEMA + _AUDIT_TRIGGERS)
+                exists = self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+                                            (_UNIQUE_INDEX,)).fetchone()
+                if not exists:
+                    key = ", ".join(_quote(c) for c in UPSERT_KEY)
+                    removed = self._conn.execute(
+                        f"""DELETE FROM {TABLE} WHERE "Неделя_Год" IS NOT NULL
+                            AND id NOT IN (SELECT MAX(id) FROM {TABLE} GROUP BY {key})""").rowcount
+                    self._conn.execute(f"CREATE UNIQUE INDEX {_UNIQUE_INDEX} ON {TABLE} ({key})")
+                    if removed:
+                        self._bump_version()
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # --- служебное ---
+    def _begin(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def _script(self, script):
+        for statement in _statements(script):
+            self._conn.execute(statement)
+
+    def _meta(self, key):
+        return self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    def _bump_version(self):
+        """Новая версия данных: по ней общие кэши понимают, что прежние результаты устарели."""
+        self._conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def _insert(self, df, update_columns=None):
+        """Вставка с заменой по ключу (KPI_ID, Неделя_Год). Возвращает (добавлено, заменено).
+
+        update_columns — колонки, которые перезаписываются у уже существующей строки (по умолчанию
+        все); остальные сохраняют прежние значения. Новые строки получают id больше прежнего
+        максимума (AUTOINCREMENT), поэтому добавленные считаются диапазоном по первичному ключу,
+        без COUNT(*) по всей таблице.
+        """
+        cols = ", ".join(_quote(c) for c in REQUIRED_COLUMNS)
+        marks = ", ".join("?" for _ in REQUIRED_COLUMNS)
+        key = ", ".join(_quote(c) for c in UPSERT_KEY)
+        update_columns = REQUIRED_COLUMNS if update_columns is None else update_columns
+        updates = ", ".join(f"{_quote(c)} = excluded.{_quote(c)}" for c in REQUIRED_COLUMNS
+                            if c in update_columns and c not in UPSERT_KEY)
+        conflict = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        records = _to_records(df)
+        max_id = self._conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {TABLE}").fetchone()[0]
+        self._conn.executemany(
+            f"INSERT INTO {TABLE} ({cols}) VALUES ({marks}) ON CONFLICT ({key}) {conflict}", records)
+        n_added = self._conn.execute(f"SELECT COUNT(*) FROM {TABLE} WHERE id > ?", (max_id,)).fetchone()[0]
+        return n_added, len(records) - n_added
+
+    # --- чтение ---
+    @property
+    def version(self):
+        with self._lock:
+            return self._meta('version')
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT 1 FROM {TABLE} LIMIT 1").fetchone() is None
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {TABLE}").fetchone()[0]
+
+    def rollup(self, period_type, selected_month_str=None):
+        """Готовые агрегаты для графиков — тот же результат, что filter_data_by_period, но без скана истории.
+        Суммы и количества из предагрегата сворачиваются по функции KPI (сумма или среднее).
+
+        "Год (по месяцам)" — все месяцы, "Месяц (по неделям)" — недели выбранного месяца
+        (поиск по первичному ключу rollup_week).
+        """
+        totals = ('name AS "Название", '
+                  'min_sum AS "Минимум_sum", min_n AS "Минимум_n", target_sum AS "Цель_sum", '
+                  'target_n AS "Цель_n", fact_sum AS "Факт_sum", fact_n AS "Факт_n"')
+        if period_type == "Год (по месяцам)":
+            sql = f"SELECT period, {totals} FROM rollup_month ORDER BY period, name"
+            params = []
+        else:
+            if selected_month_str is None:
+                return pd.DataFrame()
+            sql = f"""SELECT date_range AS period, {totals} FROM rollup_week
+                      WHERE month = ? ORDER BY week, date_range, name"""
+            params = [selected_month_str]
+
+        with self._lock:
+            df = pd.read_sql_query(sql, self._conn, params=params)
+        if df.empty:
+            return pd.DataFrame()
+        # Сумма или среднее по функции KPI — как в filter_data_by_period
+        df[NUMERICAL_COLUMNS] = totals_to_values(df, df['Название'])
+
+        if period_type == "Год (по месяцам)":
+            # Метка для оси X (Январь 2024) — считаем по уникальным месяцам, а не по строкам
+            labels = {p: pd.Timestamp(f"{p}-01").strftime('%B %Y') for p in df['period'].unique()}
+            df['Период'] = df['period'].map(labels)
+        else:
+            df['Период'] = df['period']
+        return df[['Название', 'Минимум', 'Цель', 'Факт', 'Период']]
+
+    def months(self):
+        """Месяцы истории (ГГГГ-ММ) от новых к старым — по первичному ключу rollup_month, без скана истории."""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT period FROM rollup_month ORDER BY period DESC").fetchall()
+        return [period for (period,) in rows]
+
+    def period_totals(self):
+        """Итоги по (дата, KPI) из предагрегата rollup_date — вход для aggregate_periods."""
+        sql = ('SELECT date AS "Дата_Начала", name AS "Название", '
+               'min_sum AS "Минимум_sum", min_n AS "Минимум_n", target_sum AS "Цель_sum", '
+               'target_n AS "Цель_n", fact_sum AS "Факт_sum", fact_n AS "Факт_n" FROM rollup_date')
+        with self._lock:
+            totals = pd.read_sql_query(sql, self._conn)
+        totals['Дата_Начала'] = pd.to_datetime(totals['Дата_Начала'], errors='coerce')
+        return totals.dropna(subset=['Дата_Начала'])[['Дата_Начала', 'Название'] + TOTAL_COLUMNS]
+
+    def query_periods(self, granularity="month", window=None, yoy=False, start=None, end=None, kpi_names=None):
+        """Агрегаты по неделям/месяцам/кварталам/годам или скользящему окну (см. aggregate_periods)
+        без чтения истории: по предагрегату rollup_date."""
+        return aggregate_periods(self.period_totals(), granularity, window=window, yoy=yoy, start=start,
+                                 end=end, kpi_names=kpi_names)
+
+    def load(self, start=None, end=None):
+        """Загружает историю (опционально только за [start, end]) вместе с версией данных.
+
+        Возвращает (version, df); индекс df — постоянный id строки в базе. Данные в базе
+        проверены при записи, поэтому df сразу помечается как очищенный.
+        """
+        where, params = [], []
+        if start is not None:
+            where.append('"Дата_Начала" >= ?')
+            params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            where.append('"Дата_Начала" <= ?')
+            params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        sql = f"SELECT id, {', '.join(_quote(c) for c in REQUIRED_COLUMNS)} FROM {TABLE}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id"
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                version = self._meta('version')
+                df = pd.read_sql_query(sql, self._conn, params=params, index_col="id")
+            finally:
+                self._conn.execute("COMMIT")
+
+        return version, mark_validated(apply_schema_types(df))
+
+    def iter_history(self, chunksize=10000, categories=None, by_kpi=False):
+        """История кусками по chunksize строк — для выгрузок без полной таблицы в памяти.
+
+        Порядок — по id (как в базе) или, при by_kpi=True, по KPI и дате. Все куски читаются
+        в одной транзакции, т.е. из согласованного снимка. Чтение идет через отдельное соединение
+        только для чтения (WAL не блокирует его записью), поэтому долгая выгрузка не держит общую
+        блокировку хранилища, и остальные сессии работают как обычно.
+        """
+        where, params = "", []
+        if categories:
+            where = f' WHERE "Категория" IN ({", ".join("?" for _ in categories)})'
+            params = list(categories)
+        cols = ", ".join(_quote(c) for c in REQUIRED_COLUMNS)
+        order = '"KPI_ID", "Дата_Начала", id' if by_kpi else "id"
+        sql = f"SELECT id, {cols} FROM {TABLE}{where} ORDER BY {order}"
+
+        if self.path == ":memory:":
+            # Базу в памяти видит только основное соединение: читаем снимок под блокировкой целиком
+            with self._lock:
+                chunks = list(pd.read_sql_query(sql, self._conn, params=params, index_col="id", chunksize=chunksize))
+        else:
+            conn = self._read_connection()
+            conn.execute("BEGIN")
+            chunks = pd.read_sql_query(sql, conn, params=params, index_col="id", chunksize=chunksize)
+        try:
+            for chunk in chunks:
+                if not chunk.empty:
+                    yield mark_validated(apply_schema_types(chunk))
+        finally:
+            if self.path != ":memory:":
+                conn.execute("COMMIT")
+                conn.close()
+
+    def _read_connection(self):
+        """Новое соединение к файлу базы только для чтения (mode=ro)."""
+        uri = pathlib.Path(os.path.abspath(self.path)).as_uri() + "?mode=ro"
+        return sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None)
+
+    def query_page(self, categories=None, kpi_ids=None, start=None, end=None, comment=None,
+                   sort_by="Дата_Начала", ascending=False, limit=100, offset=0):
+        """Одна страница истории для редактора: фильтрация, сортировка и LIMIT выполняются в базе.
+
+        Возвращает (total, df): total — число строк под фильтром, df — страница (индекс — id строки).
+        """
+        where, params = [], []
+        if categories:
+            where.append(f'"Категория" IN ({", ".join("?" for _ in categories)})')
+            params.extend(categories)
+        if kpi_ids:
+            where.append(f'"KPI_ID" IN ({", ".join("?" for _ in kpi_ids)})')
+            params.extend(kpi_ids)
+        if start is not None:
+            where.append('"Дата_Начала" >= ?')
+            params.append(pd.Timestamp(start).strftime('%Y-%m-%d'))
+        if end is not None:
+            where.append('"Дата_Начала" <= ?')
+            params.append(pd.Timestamp(end).strftime('%Y-%m-%d'))
+        if comment:
+            where.append('instr(py_lower("Комментарий"), ?) > 0')
+            params.append(comment.lower())
+        where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+
+        if sort_by not in REQUIRED_COLUMNS:
+            raise ValueError(f"Недопустимая колонка сортировки: {sort_by}")
+        direction = "ASC" if ascending else "DESC"
+        cols = ", ".join(_quote(c) for c in REQUIRED_COLUMNS)
+        sql = (f"SELECT id, {cols} FROM {TABLE}{where_sql} "
+               f"ORDER BY {_quote(sort_by)} {direction}, id {direction} LIMIT ? OFFSET ?")
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                total = self._conn.execute(f"SELECT COUNT(*) FROM {TABLE}{where_sql}", params).fetchone()[0]
+                df = pd.read_sql_query(sql, self._conn, params=params + [int(limit), int(offset)], index_col="id")
+            finally:
+                self._conn.execute("COMMIT")
+        return total, mark_validated(apply_schema_types(df))
+
+    # --- запись ---
+    def upsert(self, df, update_columns=None):
+        """Записывает строки: новые (KPI_ID, Неделя_Год) добавляются в конец истории, уже
+        существующие заменяются, а их прежние значения уходят в журнал. Стоимость зависит
+        только от размера df.
+
+        update_columns ограничивает замену существующих строк этими колонками (например, только
+        теми, что есть в импортируемом файле): остальные колонки строки не затираются.
+        Пачка проверяется целиком (векторно) до записи; строки без KPI_ID/Названия отбрасываются.
+        Возвращает (добавлено, заменено).
+        """
+        df = clean_data_types(df)
+        if df.empty:
+            return 0, 0
+        with self._lock:
+            self._begin()
+            try:
+                n_added, n_replaced = self._insert(df, update_columns)
+                self._bump_version()
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return n_added, n_replaced
+
+    def entry(self, kpi_id, week_id):
+        """Текущая строка KPI за неделю (поиск по уникальному ключу) — dict или None."""
+        cols = ", ".join(_quote(c) for c in REQUIRED_COLUMNS)
+        with self._lock:
+            row = self._conn.execute(f'SELECT id, {cols} FROM {TABLE} WHERE "KPI_ID" = ? AND "Неделя_Год" = ?',
+                                     (kpi_id, week_id)).fetchone()
+        return None if row is None else dict(zip(["id"] + REQUIRED_COLUMNS, row))
+
+    def audit_trail(self, kpi_id, week_id):
+        """Прежние значения KPI за неделю из журнала изменений, новые сверху."""
+        with self._lock:
+            return pd.read_sql_query(
+                f'SELECT changed_at, action, "Минимум", "Цель", "Факт", "Комментарий" FROM {AUDIT_TABLE} '
+                f'WHERE "KPI_ID" = ? AND "Неделя_Год" = ? ORDER BY audit_id DESC',
+                self._conn, params=(kpi_id, week_id))
+
+    def _fetch(self, ids):
+        """Строки по id (для точечных правок), индекс — id."""
+        cols = ", ".join(_quote(c) for c in REQUIRED_COLUMNS)
+        parts = []
+        for i in range(0, len(ids), 500):
+            chunk = list(ids[i:i + 500])
+            marks = ", ".join("?" for _ in chunk)
+            parts.append(pd.read_sql_query(f"SELECT id, {cols} FROM {TABLE} WHERE id IN ({marks})",
+                                           self._conn, params=chunk, index_col="id"))
+        return pd.concat(parts) if parts else pd.DataFrame(columns=REQUIRED_COLUMNS)
+
+    def apply_changes(self, edited=None, added=None, deleted=None):
+        """Применяет правки редактора одной транзакцией, затрагивая только измененные строки.
+
+        edited — {id: {колонка: значение}}, added — список новых строк (dict), deleted — список id.
+        Правки и новые строки проверяются clean_data_types; строки, потерявшие KPI_ID/Название,
+        не сохраняются. Новая строка с уже существующим (KPI_ID, Неделя_Год) заменяет ее и
+        считается обновленной. Возвращает (обновлено, добавлено, удалено).
+        """
+        edited = {int(k): v for k, v in (edited or {}).items()}
+        deleted = [int(i) for i in (deleted or [])]
+        added_df = clean_data_types(pd.DataFrame(added).reindex(columns=REQUIRED_COLUMNS)) if added else None
+
+        with self._lock:
+            self._begin()
+            try:
+                n_updated = 0
+                if edited:
+                    rows = self._fetch(list(edited)).astype(object)
+                    for row_id, values in edited.items():
+                        for col, value in values.items():
+                            if col in REQUIRED_COLUMNS and row_id in rows.index:
+                                rows.at[row_id, col] = value
+                    cleaned = clean_data_types(rows.reset_index())
+                    records = dict(zip(cleaned['id'], _to_records(cleaned)))
+                    for row_id, values in edited.items():
+                        # Пишем только отредактированные колонки: правка комментария не трогает предагрегаты
+                        cols = [c for c in values if c in REQUIRED_COLUMNS]
+                        if row_id not in records or not cols:
+                            continue
+                        record = dict(zip(REQUIRED_COLUMNS, records[row_id]))
+                        assignments = ", ".join(f"{_quote(c)} = ?" for c in cols)
+                        self._conn.execute(f"UPDATE {TABLE} SET {assignments} WHERE id = ?",
+                                           [record[c] for c in cols] + [row_id])
+                        n_updated += 1
+                if deleted:
+                    self._conn.executemany(f"DELETE FROM {TABLE} WHERE id = ?", [(i,) for i in deleted])
+                n_added = n_replaced = 0
+                if added_df is not None and not added_df.empty:
+                    n_added, n_replaced = self._insert(added_df)
+                if n_updated or n_added or n_replaced or deleted:
+                    self._bump_version()
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return n_updated + n_replaced, n_added, len(deleted)
+
+    def replace_all(self, df):
+        """Полностью заменяет историю (сброс тестовыми данными, массовое редактирование).
+
+        Построчные триггеры на время замены снимаются: предагрегаты пересчитываются одним GROUP BY,
+        а полная замена не записывается в журнал изменений построчно.
+        """
+        df = clean_data_types(df)
+        with self._lock:
+            self._begin()
+            try:
+                self._script(_DROP_ROLLUP_TRIGGERS + _DROP_AUDIT_TRIGGERS)
+                self._conn.execute(f"DELETE FROM {TABLE}")
+                if not df.empty:
+                    self._insert(df)
+                self._script(_REBUILD_ROLLUPS + _ROLLUP_TRIGGERS + _AUDIT_TRIGGERS)
+                self._bump_version()
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def seed_if_empty(self, make_df):
+        """Заполняет пустую базу данными из make_df() (один раз на всю базу, а не на сессию)."""
+        with self._lock:
+            if self.is_empty():
+                self.upsert(make_df())
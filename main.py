@@ -1,247 +1,161 @@
+import hashlib
+import uuid
+
 import streamlit as st
 import pandas as pd
-import plotly.graph_objects as go
-from datetime import datetime, timedelta, date
-import numpy as np
+from datetime import datetime
+
+from kpi_config import KPI_STRUCTURE, REQUIRED_COLUMNS, DB_PATH, METRICS_LOG_PATH, PROFILE_BY_DEFAULT
+from kpi_cache import SharedCache
+from kpi_charts import MAX_POINTS, build_kpi_index, render_chart, render_status_heatmap
+from kpi_data import (STATUS_RED, STATUS_YELLOW, get_week_info, generate_mock_data, status_alerts, status_table,
+                      to_display_types)
+from kpi_io import IMPORT_CHUNK_ROWS, export_csv, export_report_xlsx, import_history
+from kpi_profiler import RerunProfiler, figure_bytes, frame_bytes
+from kpi_store import KPIStore
 
 # --- НАСТРОЙКИ И КОНСТАНТЫ ---
 # Обновленная версия
 st.set_page_config(page_title="АНО «Синяя птица» - KPI Monitor v2.16 (ФИНАЛЬНАЯ СТАБИЛИЗАЦИЯ)", layout="wide")
 
-# Полная структура KPI
-KPI_STRUCTURE = {
-    "SMM (Вовлеченность)": {
-        "SMM.ER": "ER (Engagement Rate), % [KPI.СММ.1]",
-        "SMM.SHARE": "Share Rate (Репосты), %",
-        "SMM.CTR": "CTR (Клики на сайт), %"
-    },
-    "SMM (Фандрайзинг)": {
-        "SMM.DCR": "DCR (Конверсия в донат), %",
-        "SMM.MONEY": "Сумма сбора SMM, руб. (Часть KPI.ФР.1)"
-    },
-    "Программы": {
-        "KPI.ВС.1": "Заполняемость центров (Верь в себя), %",
-        "KPI.НП.1": "Своевременность решений (Нужна помощь), %",
-        "KPI.НП.2": "Объем адресной помощи, руб.",
-        "KPI.ЯЖ.1": "Мониторинг цел. использования (ЯЖивой), %"
-    },
-    "Финансы": {
-        "KPI.ФР.1_ОБЩИЙ": "Выполнение общего плана фандрайзинга, %",
-        "KPI.ФИН.1": "Соблюдение бюджета (отклонение), %",
-        "KPI.ГР.1": "Грантовая эффективность (заявки/отчеты)"
-    },
-    "HR и Администрирование": {
-        "KPI.HR.1": "Просроченные HR-задачи (Адаптация/Развитие)",
-        "KPI.ВЛ.1": "Прирост базы волонтеров, %",
-        "KPI.ДЕЛ.1": "Своевременность документооборота, %",
-        "KPI.АДМ.1": "Обработка звонков и посетителей, %"
-    }
-}
-
-# Определение колонок для создания пустой, но структурированной DF
-REQUIRED_COLUMNS = ["Дата_Начала", "Неделя_Год", "Промежуток_Дат", "Категория", "KPI_ID", "Название", "Минимум", "Цель",
-                    "Факт", "Комментарий"]
-
-
-# --- ФУНКЦИЯ ДЛЯ РАСЧЕТА НЕДЕЛИ ---
-def get_week_info(d: date):
-    """Возвращает ID недели (YYYY-WXX) и диапазон дат (DD.MM.YYYY - DD.MM.YYYY)."""
-    start_of_week = d - timedelta(days=d.weekday())
-    end_of_week = start_of_week + timedelta(days=6)
-    week_year_id = start_of_week.strftime('%Y-W%W')
-    date_range = f"{start_of_week.strftime('%d.%m.%Y')} - {end_of_week.strftime('%d.%m.%Y')}"
-    return start_of_week, week_year_id, date_range
-
-
-# --- ГЕНЕРАЦИЯ ТЕСТОВЫХ ДАННЫХ ---
-def generate_mock_data():
-    data = []
-    end_date = datetime.now()
-    start_date = datetime(end_date.year, 1, 1)
-
-    categories_map = {
-        "SMM.MONEY": ("Сумма сбора SMM, руб. (Часть KPI.ФР.1)", 40000.0, 60000.0),
-        "SMM.ER": ("ER (Engagement Rate), % [KPI.СММ.1]", 2.5, 4.0),
-        "SMM.DCR": ("DCR (Конверсия в донат), %", 1.0, 2.0),
-        "SMM.SHARE": ("Share Rate (Репосты), %", 0.5, 1.0),
-        "KPI.ВС.1": ("Заполняемость центров (Верь в себя), %", 85.0, 95.0),
-        "KPI.ФИН.1": ("Соблюдение бюджета (отклонение), %", 5.0, 0.0),
-        "KPI.ФР.1_ОБЩИЙ": ("Выполнение общего плана фандрайзинга, %", 80.0, 100.0),
-    }
-
-    current_date = start_date
-    while current_date <= end_date:
-        # Вносим данные за каждый понедельник
-        if current_date.weekday() == 0 or current_date == start_date:
-            start_of_week, week_id, date_range_str = get_week_info(current_date.date())
-
-            for kpi_id, (name, min_val, target_val) in categories_map.items():
-                if np.random.random() > 0.1:
-
-                    if kpi_id == "KPI.ФИН.1":
-                        fact_val = abs(np.random.normal(2, 2))
-                    elif 'MONEY' in kpi_id:
-                        fact_val = np.random.uniform(min_val * 0.8, target_val * 1.2)
-                    else:
-                        fact_val = np.random.normal(target_val, target_val * 0.15)
-
-                    fact_val = max(0, fact_val)
-
-                    category = next((cat_name for cat_name, kpis in KPI_STRUCTURE.items() if kpi_id in kpis), "Прочее")
-
-                    data.append({
-                        "Дата_Начала": start_of_week,
-                        "Неделя_Год": week_id,
-                        "Промежуток_Дат": date_range_str,
-                        "Категория": category,
-                        "KPI_ID": kpi_id,
-                        "Название": name,
-                        "Минимум": min_val,
-                        "Цель": target_val,
-                        "Факт": round(fact_val, 2),
-                        "Комментарий": ""
-                    })
-
-        current_date += timedelta(days=7)
-
-    df = pd.DataFrame(data)
-    # Гарантируем, что даты - это Python date объекты
-    df['Дата_Начала'] = pd.to_datetime(df['Дата_Начала']).dt.date
-    return df
+# Диагностика (по желанию): замеры этапов этого перезапуска, см. панель в конце боковой колонки
+prof = RerunProfiler(enabled=st.session_state.get("profiling_enabled", PROFILE_BY_DEFAULT),
+                     log_path=METRICS_LOG_PATH,
+                     session_id=st.session_state.setdefault("session_id", uuid.uuid4().hex[:8]))
 
+# --- ХРАНИЛИЩЕ ---
+@st.cache_resource
+def get_store():
+    """Одно хранилище на процесс — общее для всех сессий."""
+    return KPIStore(DB_PATH)
 
-# --- ФУНКЦИЯ ПРИНУДИТЕЛЬНОЙ ОЧИСТКИ ДАННЫХ ---
-def clean_data_types(df):
-    """Обеспечивает корректность типов данных и удаляет только критически некорректные строки.
-    Не удаляем строки при отсутствии одного из числовых полей — это было причиной потери всей БД.
-    """
-    if not isinstance(df, pd.DataFrame):
-        return pd.DataFrame(columns=REQUIRED_COLUMNS)
 
-    # Если вход пуст — возвращаем корректно структурированную пустую DF
-    if df.empty:
-        return pd.DataFrame(columns=REQUIRED_COLUMNS)
+store = get_store()
+store.seed_if_empty(generate_mock_data)
 
-    # Приведение даты к Python date object (если есть колонка)
-    if 'Дата_Начала' in df.columns:
-        df['Дата_Начала'] = pd.to_datetime(df['Дата_Начала'], errors='coerce').dt.date
-    else:
-        return pd.DataFrame(columns=REQUIRED_COLUMNS)
+# Сессия хранит только номер версии данных, прочитанный в начале перезапуска: все агрегаты и
+# фигуры этого перезапуска берутся из общих кэшей по этой версии. Копии истории в сессии нет —
+# запись в базу просто публикует новую версию, и следующие перезапуски всех сессий видят ее.
+st.session_state.kpi_version = store.version
 
-    # Приведение числовых колонок к float, но не удаляем строки из-за NaN в них
-    numerical_cols = ['Минимум', 'Цель', 'Факт']
-    for col in numerical_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
 
-    # Удаляем только строки, где отсутствует KPI_ID или Название — эти поля критичны.
-    df = df.dropna(subset=['KPI_ID', 'Название'])
+# --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
 
-    # Сбрасываем индекс (чтобы избежать проблем с неправильными индексами после редактирования)
-    df = df.reset_index(drop=True)
+@st.cache_resource
+def get_figure_cache():
+    """LRU-кэш фигур, общий для всех сессий (ключ включает версию данных)."""
+    return SharedCache(maxsize=256)
 
-    # Убедимся, что все нужные колонки присутствуют (добавим отсутствующие с NaN/пустотой)
-    for c in REQUIRED_COLUMNS + ['Дата_Начала_DT', 'Период']:
-        if c not in df.columns:
-            df[c] = pd.NA
 
-    return df
+@st.cache_resource
+def get_data_cache():
+    """Агрегаты и индексы по версии данных, общие для всех сессий (только для чтения)."""
+    return SharedCache(maxsize=64)
 
 
+@st.cache_resource
+def get_export_cache():
+    """Готовые файлы выгрузки по (вид, версия данных) — общие для всех сессий, держим пару последних."""
+    return SharedCache(maxsize=4)
 
-# Инициализация Session State
-if 'kpi_history' not in st.session_state:
-    st.session_state.kpi_history = generate_mock_data()
-else:
-    st.session_state.kpi_history = clean_data_types(st.session_state.kpi_history)
 
+figure_cache = get_figure_cache()
+data_cache = get_data_cache()
+export_cache = get_export_cache()
 
-# --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
 
-def filter_data_by_period(df, period_type, selected_month_str=None):
-    """Фильтрует и группирует данные: по месяцам (для Года) или по неделям (для Месяца)."""
-    df = df.copy()
+def export_file(kind):
+    """Файл выгрузки по запросу: собирается при нажатии кнопки скачивания, а не на каждом перезапуске.
 
-    # Если данные уже очищены функцией clean_data_types, они должны быть в формате Python date objects.
-    # Преобразование в datetime64[ns] для Pandas-агрегации.
-    df['Дата_Начала_DT'] = pd.to_datetime(df['Дата_Начала'], errors='coerce')
-    numerical_cols = ['Минимум', 'Цель', 'Факт']
+    Передается в st.download_button как функция; повторные скачивания той же версии данных
+    (из любой сессии) отдаются из кэша.
+    """
+    build = {"csv": export_csv, "xlsx": export_report_xlsx}[kind]
+    return lambda: export_cache.get_or_build((kind, store.version), lambda: build(store))[0]
 
-    # КРИТИЧЕСКИЙ ФИЛЬТР: Отбрасываем строки, где нет даты или числа
-    df = df.dropna(subset=['Дата_Начала_DT', 'Название'])
-    if df.empty:
-        return pd.DataFrame()
 
-    # 2. Фильтрация и группировка
-    if period_type == "Год (по месяцам)":
+def shared_cached(name, *args, build):
+    """Результат из общего кэша по (имя, версия данных, *args): один на всех зрителей этой версии."""
+    return data_cache.get_or_build((name, st.session_state.kpi_version) + args, build)
 
-        # Ключ для группировки и сортировки (YYYY-MM)
-        df['Period_Key'] = df['Дата_Начала_DT'].dt.strftime('%Y-%m')
 
-        # Метка для оси X (Январь 2024)
-        df['Период_Display'] = df['Дата_Начала_DT'].dt.strftime('%B %Y')
+def get_period_view(period_type, selected_month_str=None):
+    """Агрегаты для графиков из предагрегатов базы.
 
-        # Группируем по ключу периода и Названию KPI
-        df_grouped = df.groupby(['Period_Key', 'Период_Display', 'Название'])[numerical_cols].mean().reset_index()
+    Результат общий для всех сессий по (версия данных, период, месяц): переключение радиокнопки
+    или месяца — это поиск в словаре, а любая запись в базу меняет версию.
+    """
+    with prof.stage("period_view") as rec:
+        df, rec["cache_hit"] = shared_cached('period_view', period_type, selected_month_str,
+                                             build=lambda: store.rollup(period_type, selected_month_str))
+        rec["rows"] = len(df)
+    return df
 
-        # Сортируем по надежному строковому ключу
-        df_grouped = df_grouped.sort_values('Period_Key')
-        df_grouped['Период'] = df_grouped['Период_Display']  # Финальная колонка метки
 
+def get_kpi_index(period_type, selected_month_str=None):
+    """Индекс агрегата по KPI — строится один раз на агрегат, а не маской на каждый график."""
+    index, _ = shared_cached('kpi_index', period_type, selected_month_str,
+                             build=lambda: build_kpi_index(get_period_view(period_type, selected_month_str)))
+    return index
 
-    else:  # Месяц (по неделям)
-        if selected_month_str is None:
-            return pd.DataFrame()
 
-        y, m = map(int, selected_month_str.split('-'))
+def get_period_query(granularity, window=None, yoy=False):
+    """Агрегаты по произвольной гранулярности (store.query_periods), общие по версии данных."""
+    with prof.stage("period_query") as rec:
+        df, rec["cache_hit"] = shared_cached('period_query', granularity, window, yoy,
+                                             build=lambda: store.query_periods(granularity, window=window, yoy=yoy))
+        rec["rows"] = len(df)
+    return df
 
-        # Фильтрация по году и месяцу
-        df_filtered = df[(df['Дата_Начала_DT'].dt.year == y) & (df['Дата_Начала_DT'].dt.month == m)].copy()
 
-        if df_filtered.empty:
-            return pd.DataFrame()
+def get_period_query_index(granularity, window=None, yoy=False):
+    """Индекс агрегата get_period_query по KPI, общий по версии данных."""
+    index, _ = shared_cached('period_query_index', granularity, window, yoy,
+                             build=lambda: build_kpi_index(get_period_query(granularity, window, yoy)))
+    return index
 
-        # Группировка по уже существующим надежным строковым колонкам
-        df_grouped = df_filtered.groupby(['Неделя_Год', 'Промежуток_Дат', 'Название'])[
-            numerical_cols].mean().reset_index()
-        df_grouped = df_grouped.sort_values('Неделя_Год')
-        df_grouped['Период'] = df_grouped['Промежуток_Дат']
 
-    # Возвращаем только необходимые для графика колонки
-    return df_grouped[['Название', 'Минимум', 'Цель', 'Факт', 'Период']]
+def get_months():
+    """Месяцы истории от новых к старым (ключи предагрегата rollup_month), общие по версии данных."""
+    with prof.stage("months") as rec:
+        months, rec["cache_hit"] = shared_cached('months', build=store.months)
+        rec["rows"] = len(months)
+    return months
 
 
-def render_chart(df_grouped, kpi_name, title_prefix="Динамика"):
-    chart_data = df_grouped[df_grouped['Название'] == kpi_name]
+def select_month(label, key):
+    """Выбор месяца для режима «Месяц (по неделям)» — общий для дашборда и SMM."""
+    months = get_months() or [datetime.now().strftime('%Y-%m')]
+    return st.selectbox(label, months, index=0, key=key)
+
+
+def detail_window(kpi_rows, key):
+    """Ползунок окна детализации под длинным рядом (больше MAX_POINTS периодов).
+
+    Ряд рисуется прореженным; выбранное окно перерисовывается в полном разрешении
+    (Streamlit не передает в Python события зума Plotly). Возвращает x_range для render_chart
+    или None — весь ряд.
+    """
+    if kpi_rows is None or len(kpi_rows) <= MAX_POINTS:
+        return None
+    periods = kpi_rows['Период'].astype(str).tolist()
+    x_range = st.select_slider("Окно детализации", options=periods, value=(periods[0], periods[-1]), key=key)
+    return None if tuple(x_range) == (periods[0], periods[-1]) else tuple(x_range)
 
-    if chart_data.empty:
-        fig = go.Figure()
-        fig.update_layout(
-            annotations=[dict(text="Нет данных для построения графика", showarrow=False)],
-            xaxis={'visible': False}, yaxis={'visible': False}, height=350, title=f"{title_prefix}: {kpi_name}"
-        )
-        return fig
-
-    fig = go.Figure()
-    fig.add_trace(
-        go.Scatter(x=chart_data['Период'], y=chart_data['Цель'], name='Цель', line=dict(color='green', dash='dash')))
-    fig.add_trace(go.Scatter(x=chart_data['Период'], y=chart_data['Минимум'], name='Минимум',
-                             line=dict(color='orange', dash='dot')))
-    fig.add_trace(
-        go.Scatter(x=chart_data['Период'], y=chart_data['Факт'], name='Факт', line=dict(color='blue', width=3),
-                   mode='lines+markers'))
-
-    fig.update_layout(
-        title=f"{title_prefix}: {kpi_name}",
-        xaxis_title="Отчетный период",
-        yaxis_title="Значение",
-        margin=dict(l=20, r=20, t=40, b=20),
-        height=350
-    )
-    if len(chart_data['Период'].unique()) > 6:
-        fig.update_xaxes(tickangle=45)
-
-    return fig
+
+def show_chart(period_type, selected_month_str, kpi_name):
+    """Выводит график KPI. Готовая фигура берется из общего кэша по (версия, период, месяц, KPI, окно)."""
+    kpi_index = get_kpi_index(period_type, selected_month_str)
+    chart_slot = st.container()
+    x_range = detail_window(kpi_index.get(kpi_name), key=f"zoom_{period_type}_{selected_month_str}_{kpi_name}")
+
+    key = (st.session_state.kpi_version, period_type, selected_month_str, kpi_name, x_range)
+    with prof.stage("render_chart") as rec:
+        fig, rec["cache_hit"] = figure_cache.get_or_build(key, lambda: render_chart(
+            get_period_view(period_type, selected_month_str), kpi_name, kpi_index=kpi_index, x_range=x_range))
+        rec["kpi"] = kpi_name
+    with prof.stage("plotly_chart", nbytes=figure_bytes(fig) if prof.enabled else None):
+        chart_slot.plotly_chart(fig, use_container_width=True)
 
 
 # --- ИНТЕРФЕЙС ---
@@ -251,12 +165,15 @@ st.sidebar.title("🕊️ Синяя Птица")
 # --- КНОПКА СБРОСА ДАННЫХ (РЕМОНТ) ---
 if st.sidebar.button("🚨 СБРОСИТЬ ВСЕ ДАННЫЕ (РЕМОНТ)"):
     # Clear corrupted data and regenerate mock data
-    st.session_state.kpi_history = generate_mock_data()
+    store.replace_all(generate_mock_data())
     st.rerun()
     st.success("Данные полностью сброшены и заменены тестовыми. Графики должны работать.")
 
+st.sidebar.toggle("🩺 Диагностика производительности", value=PROFILE_BY_DEFAULT, key="profiling_enabled")
+
 # --- МЕНЮ ---
-menu = st.sidebar.radio("Навигация", ["Сводный Дашборд", "SMM Эффективность", "Ввод данных KPI", "История (Редактор)"])
+menu = st.sidebar.radio("Навигация", ["Сводный Дашборд", "SMM Эффективность", "Ввод данных KPI", "История (Редактор)",
+                                    "Импорт данных"])
 
 # --- 1. СВОДНЫЙ ДАШБОРД ---
 if menu == "Сводный Дашборд":
@@ -270,23 +187,11 @@ if menu == "Сводный Дашборд":
     selected_month_str = None
     if period_type == "Месяц (по неделям)":
         with col_per2:
-            df_dates = st.session_state.kpi_history.copy()
-            df_dates['Дата_Начала_DT'] = pd.to_datetime(df_dates['Дата_Начала'], errors='coerce')
-            df_dates = df_dates.dropna(subset=['Дата_Начала_DT'])
-            df_dates['Month_Str'] = df_dates['Дата_Начала_DT'].dt.strftime('%Y-%m')
-            available_months = sorted(df_dates['Month_Str'].unique(), reverse=True)
-
-            if not available_months:
-                available_months = [datetime.now().strftime('%Y-%m')]
-
-            default_index = 0 if available_months else 0
-            selected_month_str = st.selectbox("Выберите месяц:", available_months, index=default_index,
-                                              key="dashboard_month_select")
+            selected_month_str = select_month("Выберите месяц:", key="dashboard_month_select")
 
     st.divider()
 
-    df_source = st.session_state.kpi_history.copy()
-    df_viz = filter_data_by_period(df_source, period_type, selected_month_str)
+    df_viz = get_period_view(period_type, selected_month_str)
 
     if df_viz.empty:
         st.warning("Нет данных для отображения за выбранный период. Проверьте вкладку 'История (Редактор)'.")
@@ -298,9 +203,61 @@ if menu == "Сводный Дашборд":
         kpi_program = "Заполняемость центров (Верь в себя), %"
 
         with c1:
-            st.plotly_chart(render_chart(df_viz, kpi_finance), use_container_width=True)
+            show_chart(period_type, selected_month_str, kpi_finance)
         with c2:
-            st.plotly_chart(render_chart(df_viz, kpi_program), use_container_width=True)
+            show_chart(period_type, selected_month_str, kpi_program)
+
+        # Светофор по всем KPI: одна тепловая карта вместо графика на каждый показатель
+        st.subheader("Статусы всех KPI")
+        key = (st.session_state.kpi_version, "status_heatmap", period_type, selected_month_str)
+        with prof.stage("status_heatmap") as rec:
+            fig, rec["cache_hit"] = figure_cache.get_or_build(
+                key, lambda: render_status_heatmap(*status_table(df_viz), title="Статусы KPI по периодам"))
+        st.plotly_chart(fig, use_container_width=True)
+
+        alerts = status_alerts(df_viz, statuses=(STATUS_RED, STATUS_YELLOW))
+        with st.expander(f"🚨 Требуют внимания ({len(alerts)})", expanded=bool(len(alerts))):
+            if alerts.empty:
+                st.success("Все KPI в последнем периоде достигли цели.")
+            for alert in alerts.itertuples(index=False):
+                icon, threshold = ("🔴", "минимуме") if alert.Статус == STATUS_RED else ("🟡", "цели")
+                value = alert.Минимум if alert.Статус == STATUS_RED else alert.Цель
+                st.markdown(f"{icon} **{alert.Название}** — {alert.Период}: факт {alert.Факт:,.2f} "
+                            f"при {threshold} {value:,.2f}")
+
+    # Анализ по периодам: неделя / месяц / квартал / год / скользящее окно, сравнение с прошлым годом
+    st.divider()
+    st.subheader("Анализ по периодам")
+    granularities = {"Неделя": "week", "Месяц": "month", "Квартал": "quarter", "Год": "year",
+                     "Скользящее окно (недели)": "week"}
+    all_kpi_names = [name for kpis in KPI_STRUCTURE.values() for name in kpis.values()]
+    g1, g2, g3, g4 = st.columns([1, 1, 2, 1])
+    with g1:
+        granularity_label = st.selectbox("Гранулярность:", list(granularities), index=1, key="pq_granularity")
+    window = None
+    if granularity_label == "Скользящее окно (недели)":
+        with g2:
+            window = int(st.number_input("Окно, недель:", min_value=2, max_value=52, value=4, key="pq_window"))
+    with g3:
+        pq_kpi = st.selectbox("KPI:", all_kpi_names, key="pq_kpi")
+    with g4:
+        pq_yoy = st.toggle("Сравнить с прошлым годом", key="pq_yoy")
+
+    granularity = granularities[granularity_label]
+    df_pq = get_period_query(granularity, window, pq_yoy)
+    pq_index = get_period_query_index(granularity, window, pq_yoy)
+    pq_slot = st.container()
+    # Недели и скользящее окно за несколько лет — длинный ряд: под графиком окно детализации
+    pq_range = detail_window(pq_index.get(pq_kpi), key=f"zoom_pq_{granularity}_{window}_{pq_kpi}")
+    key = (st.session_state.kpi_version, "periods", granularity, window, pq_yoy, pq_kpi, pq_range)
+    with prof.stage("render_chart") as rec:
+        fig, rec["cache_hit"] = figure_cache.get_or_build(key, lambda: render_chart(
+            df_pq, pq_kpi, title_prefix=granularity_label, kpi_index=pq_index, x_range=pq_range))
+        rec["kpi"] = pq_kpi
+    pq_slot.plotly_chart(fig, use_container_width=True)
+    if pq_yoy:
+        st.dataframe(df_pq[df_pq['Название'] == pq_kpi].drop(columns=['Название', 'Начало_Периода']),
+                     hide_index=True, use_container_width=True)
 
 # --- 2. SMM ЭФФЕКТИВНОСТЬ ---
 elif menu == "SMM Эффективность":
@@ -314,39 +271,30 @@ elif menu == "SMM Эффективность":
     smm_month_str = None
     if smm_period_type == "Месяц (по неделям)":
         with col_s2:
-            df_dates = st.session_state.kpi_history.copy()
-            df_dates['Дата_Начала_DT'] = pd.to_datetime(df_dates['Дата_Начала'], errors='coerce')
-            df_dates = df_dates.dropna(subset=['Дата_Начала_DT'])
-            df_dates['Month_Str'] = df_dates['Дата_Начала_DT'].dt.strftime('%Y-%m')
-            smm_months = sorted(df_dates['Month_Str'].unique(), reverse=True)
-            default_index = 0 if smm_months else 0
-            smm_month_str = st.selectbox("Месяц:", smm_months, index=default_index, key="smm_select")
+            smm_month_str = select_month("Месяц:", key="smm_select")
 
     st.divider()
 
-    df_source = st.session_state.kpi_history.copy()
-    df_smm_viz = filter_data_by_period(df_source, smm_period_type, smm_month_str)
-
     # 3.1 Вовлеченность
     st.subheader("3.1 Вовлеченность (Engagement)")
     tabs = st.tabs(["ER (Engagement Rate)", "Share Rate", "CTR"])
 
     with tabs[0]:
-        st.plotly_chart(render_chart(df_smm_viz, "ER (Engagement Rate), % [KPI.СММ.1]"), use_container_width=True)
+        show_chart(smm_period_type, smm_month_str, "ER (Engagement Rate), % [KPI.СММ.1]")
 
     with tabs[1]:
-        st.plotly_chart(render_chart(df_smm_viz, "Share Rate (Репосты), %"), use_container_width=True)
+        show_chart(smm_period_type, smm_month_str, "Share Rate (Репосты), %")
 
     with tabs[2]:
-        st.plotly_chart(render_chart(df_smm_viz, "CTR (Клики на сайт), %"), use_container_width=True)
+        show_chart(smm_period_type, smm_month_str, "CTR (Клики на сайт), %")
 
     # 3.2 Фандрайзинг
     st.subheader("3.2 SMM Фандрайзинг")
     c_fund1, c_fund2 = st.columns(2)
     with c_fund1:
-        st.plotly_chart(render_chart(df_smm_viz, "DCR (Конверсия в донат), %"), use_container_width=True)
+        show_chart(smm_period_type, smm_month_str, "DCR (Конверсия в донат), %")
     with c_fund2:
-        st.plotly_chart(render_chart(df_smm_viz, "Сумма сбора SMM, руб. (Часть KPI.ФР.1)"), use_container_width=True)
+        show_chart(smm_period_type, smm_month_str, "Сумма сбора SMM, руб. (Часть KPI.ФР.1)")
 
 
 # --- 3. ВВОД ДАННЫХ KPI ---
@@ -417,16 +365,22 @@ elif menu == "Ввод данных KPI":
                 "Комментарий": comment
             }
 
-            # Добавляем новую строку
-            st.session_state.kpi_history = pd.concat(
-                [st.session_state.kpi_history, pd.DataFrame([new_row])],
-                ignore_index=True
-            )
-
-            # КРИТИЧЕСКОЕ ИСПРАВЛЕНИЕ V2.16.1: Очистка типов сразу после добавления (для исправления пустых графиков)
-            st.session_state.kpi_history = clean_data_types(st.session_state.kpi_history)
-
-            st.success(f"Показатель '{kpi_name_full}' за {date_range} успешно добавлен!")
+            # Одна строка на KPI за неделю: повторный ввод заменяет значение, прежнее уходит в журнал
+            n_added, _ = store.upsert(pd.DataFrame([new_row]))
+
+            if n_added:
+                st.success(f"Показатель '{kpi_name_full}' за {date_range} успешно добавлен!")
+            else:
+                st.success(f"Показатель '{kpi_name_full}' за {date_range} обновлен (прежнее значение в журнале).")
+
+        existing = store.entry(selected_kpi_key, week_id)
+        if existing is not None and not submitted:
+            st.info(f"За эту неделю уже внесено: факт {existing['Факт']}, цель {existing['Цель']}. "
+                    "Сохранение заменит значение, прежнее останется в журнале изменений.")
+        trail = store.audit_trail(selected_kpi_key, week_id)
+        if not trail.empty:
+            with st.expander(f"🕓 Журнал изменений за неделю ({len(trail)})"):
+                st.dataframe(trail, hide_index=True, use_container_width=True)
     else:
         st.warning("Выберите действительный KPI, чтобы ввести данные.")
 
@@ -441,30 +395,35 @@ elif menu == "История (Редактор)":
     * Изменения сохраняются автоматически.
     """)
 
-    if st.session_state.kpi_history.empty:
+    if store.is_empty():
         st.warning("База данных пуста.")
 
     else:
 
-        def save_changes():
-            changes = st.session_state.get("editor", None)
-            # защита: если Streamlit вернул не DataFrame — ничего не делаем
-            if not isinstance(changes, pd.DataFrame):
+        def save_changes(editor_key, row_ids):
+            changes = st.session_state.get(editor_key, None)
+            # st.data_editor отдает не таблицу, а изменения: edited_rows / added_rows / deleted_rows,
+            # где строки заданы позицией в показанной (отсортированной) таблице.
+            if not isinstance(changes, dict):
                 st.warning("Обновление не сохранено: неожиданный формат данных от редактора.")
                 return
 
-            cleaned = clean_data_types(changes)
+            # Позиции -> постоянные id строк в базе
+            edited = {row_ids[int(pos)]: values for pos, values in changes.get("edited_rows", {}).items()}
+            deleted = [row_ids[int(pos)] for pos in changes.get("deleted_rows", [])]
+            # KPI_ID в редакторе не редактируется — для новых строк восстанавливаем его по Названию
+            name_to_id = {name: kpi_id for kpis in KPI_STRUCTURE.values() for kpi_id, name in kpis.items()}
+            added = [{"KPI_ID": name_to_id.get(row.get("Название")), **row} for row in changes.get("added_rows", [])]
 
-            # Если cleaned пустой (пользователь удалил всё или данные стали некорректными),
-            # не затираем базу автоматически — оставим предыдущую версию и уведомим.
-            if cleaned.empty:
-                st.warning(
-                    "После изменений данные стали пустыми — сохранение отменено. Проверьте поля KPI_ID/Название и числовые колонки.")
-                return
+            n_updated, n_added, n_deleted = store.apply_changes(edited, added, deleted)
 
-            # Только если всё в порядке — сохраняем
-            st.session_state.kpi_history = cleaned
-            st.success("Изменения сохранены.")
+            # Новое поколение редактора: старые позиции после записи уже не совпадают с таблицей
+            st.session_state.editor_generation = st.session_state.get('editor_generation', 0) + 1
+
+            rejected = len(edited) - n_updated + len(added) - n_added
+            if rejected:
+                st.warning(f"Не сохранено строк: {rejected}. Проверьте поля KPI_ID/Название.")
+            st.success(f"Изменения сохранены: изменено {n_updated}, добавлено {n_added}, удалено {n_deleted}.")
 
 
         # Конфигурация колонок
@@ -483,14 +442,121 @@ elif menu == "История (Редактор)":
             "Комментарий": st.column_config.TextColumn("Комментарий", width="large")
         }
 
-        st.data_editor(
-            st.session_state.kpi_history.sort_values("Дата_Начала", ascending=False),
-            column_config=column_config,
-            num_rows="dynamic",
-            use_container_width=True,
-            key="editor",
-            on_change=save_changes
+        # Фильтры, сортировка и разбиение на страницы выполняются в базе: в браузер уходит только страница
+        kpi_names = {k: v for kpis in KPI_STRUCTURE.values() for k, v in kpis.items()}
+        with st.expander("🔎 Фильтры и сортировка", expanded=True):
+            f_cat, f_kpi, f_dates = st.columns(3)
+            with f_cat:
+                flt_categories = st.multiselect("Категория", list(KPI_STRUCTURE.keys()), key="hist_categories")
+            with f_kpi:
+                flt_kpis = st.multiselect("KPI", list(kpi_names), format_func=lambda x: f"{x} — {kpi_names[x]}",
+                                          key="hist_kpis")
+            with f_dates:
+                flt_dates = st.date_input("Период (с — по)", value=(), format="DD.MM.YYYY", key="hist_dates")
+
+            f_comment, f_sort, f_order, f_size = st.columns([2, 1, 1, 1])
+            with f_comment:
+                flt_comment = st.text_input("Текст в комментарии", key="hist_comment")
+            with f_sort:
+                sort_by = st.selectbox("Сортировка", REQUIRED_COLUMNS, key="hist_sort")
+            with f_order:
+                sort_order = st.radio("Порядок", ["По убыванию", "По возрастанию"], key="hist_order")
+            with f_size:
+                page_size = st.selectbox("Строк на странице", [50, 100, 250, 500], index=1, key="hist_page_size")
+
+        view_params = dict(
+            categories=flt_categories,
+            kpi_ids=flt_kpis,
+            start=flt_dates[0] if len(flt_dates) > 0 else None,
+            end=flt_dates[1] if len(flt_dates) > 1 else None,
+            comment=flt_comment.strip() or None,
+            sort_by=sort_by,
+            ascending=sort_order == "По возрастанию",
         )
 
-        csv = st.session_state.kpi_history.to_csv(index=False).encode('utf-8')
-        st.download_button("📥 Скачать бэкап (CSV)", csv, "kpi_full_backup.csv", "text/csv")
\ No newline at end of file
+        page = st.session_state.get("hist_page", 1)
+        with prof.stage("query_page") as rec:
+            total, view = store.query_page(**view_params, limit=page_size, offset=(page - 1) * page_size)
+            n_pages = max(1, -(-total // page_size))
+            if page > n_pages:
+                # Фильтр сузил выборку — переходим на последнюю существующую страницу
+                page = st.session_state.hist_page = n_pages
+                total, view = store.query_page(**view_params, limit=page_size, offset=(page - 1) * page_size)
+            rec["rows"] = len(view)
+
+        # Ключ редактора зависит от страницы и фильтров: правки всегда относятся к показанным строкам
+        view_digest = hashlib.md5(repr((view_params, page, page_size)).encode("utf-8")).hexdigest()[:8]
+        editor_key = f"editor_{st.session_state.get('editor_generation', 0)}_{view_digest}"
+
+        view_display = to_display_types(view)
+        with prof.stage("data_editor", rows=len(view_display),
+                        nbytes=frame_bytes(view_display) if prof.enabled else None):
+            st.data_editor(
+                view_display,
+                column_config=column_config,
+                num_rows="dynamic",
+                use_container_width=True,
+                key=editor_key,
+                on_change=save_changes,
+                args=(editor_key, view.index.tolist())
+            )
+
+        c_page, c_info = st.columns([1, 3])
+        with c_page:
+            st.number_input("Страница", min_value=1, max_value=n_pages, step=1, key="hist_page")
+        with c_info:
+            first_row = (page - 1) * page_size + 1 if total else 0
+            st.caption(f"Строки {first_row}–{(page - 1) * page_size + len(view)} из {total} (страниц: {n_pages})")
+
+        c_csv, c_xlsx = st.columns(2)
+        with c_csv:
+            st.download_button("📥 Скачать бэкап (CSV)", export_file("csv"), "kpi_full_backup.csv", "text/csv")
+        with c_xlsx:
+            st.download_button("📊 Отчет по категориям (XLSX)", export_file("xlsx"), "kpi_report.xlsx",
+                               "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+# --- 5. ИМПОРТ ДАННЫХ ---
+elif menu == "Импорт данных":
+    st.title("📤 Импорт истории из CSV / Excel")
+    st.info("""
+    **Формат:** колонки как в бэкапе (`kpi_full_backup.csv`). Обязательны `Дата_Начала` и `KPI_ID`,
+    числа — `Минимум`, `Цель`, `Факт`. Неделя, период, название и категория KPI пересчитываются
+    автоматически. Запись того же KPI за ту же неделю заменяет существующую (прежняя — в журнале);
+    колонки, которых нет в файле, у существующих записей остаются без изменений.
+    CSV — в кодировке UTF-8 или Windows-1251, с разделителем `,` или `;`.
+    """)
+
+    uploaded = st.file_uploader("Файл CSV или XLSX", type=["csv", "xlsx"], key="import_file")
+    if uploaded is not None and st.button("📥 Импортировать", key="import_run"):
+        progress_bar = st.progress(0.0, text="Чтение файла...")
+
+        def show_progress(done, total):
+            fraction = min(done / total, 1.0) if total else 0.0
+            progress_bar.progress(fraction, text=f"Обработано строк: {done:,}" + (f" из {total:,}" if total else ""))
+
+        try:
+            with prof.stage("import") as rec:
+                report = import_history(store, uploaded, filename=uploaded.name, chunksize=IMPORT_CHUNK_ROWS,
+                                        progress=show_progress)
+                rec["rows"] = report["read"]
+        except ValueError as e:
+            # kpi_io сообщает так обо всех ошибках файла: формат, кодировка, поврежденная книга, нет листов
+            progress_bar.empty()
+            st.error(f"Импорт не выполнен: {e}")
+        else:
+            progress_bar.progress(1.0, text="Готово")
+            st.success(f"Прочитано строк: {report['read']}. Добавлено: {report['added']}, "
+                       f"заменено: {report['replaced']}, отклонено: {report['rejected']}.")
+            if report["rejected"]:
+                st.warning("Отклоненные строки (первые из них):")
+                st.dataframe(report["rejected_sample"], hide_index=True, use_container_width=True)
+
+
+# --- ПАНЕЛЬ ДИАГНОСТИКИ ---
+if prof.enabled:
+    df_stages = pd.DataFrame(prof.stages, columns=["stage", "ms", "rows", "bytes"])
+    with st.sidebar.expander("🩺 Этапы этого перезапуска", expanded=True):
+        st.dataframe(df_stages, hide_index=True, use_container_width=True)
+        st.caption(f"Всего: {prof.total_ms():.1f} мс · в браузер: {df_stages['bytes'].sum():.0f} байт · "
+                   f"журнал: {METRICS_LOG_PATH}")
+    prof.flush(page=menu)
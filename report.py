@@ -0,0 +1,165 @@
+"""Пакетный отчет KPI в один автономный HTML-файл (без запуска интерфейса Streamlit).
+
+Для каждого KPI из KPI_STRUCTURE строит графики render_chart в обоих режимах: «Год (по месяцам)»
+и «Месяц (по неделям)» за каждый месяц истории. Агрегаты считаются один раз: помесячный — через
+filter_data_by_period, понедельный — одним groupby по всем месяцам (filter_weeks_by_month);
+графики строятся параллельно в пуле процессов. plotly.js встраивается в файл один раз, поэтому
+отчет открывается без интернета.
+
+Пример:
+    python report.py
+    python report.py --months 3 --jobs 8 --output reports/board.html
+    python report.py --mock-years 3
+"""
+import argparse
+import html
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+
+from kpi_charts import build_kpi_index, render_chart
+from kpi_config import DB_PATH, KPI_STRUCTURE
+from kpi_data import filter_data_by_period, filter_weeks_by_month, generate_mock_data
+
+YEAR_MODE = "Год (по месяцам)"
+MONTH_MODE = "Месяц (по неделям)"
+
+
+def load_history(db_path, mock_years=None, seed=42):
+    """История из базы приложения или синтетическая (--mock-years) — типизированная таблица."""
+    if mock_years:
+        return generate_mock_data(years=mock_years, rng=np.random.default_rng(seed))
+    from kpi_store import KPIStore
+    _, df = KPIStore(db_path).load()
+    return df
+
+
+def plan_sections(df, months=None):
+    """Разделы отчета: (заголовок, префикс графика, агрегат по KPI). Агрегаты считаются здесь, один раз."""
+    sections = [(YEAR_MODE, "Динамика", build_kpi_index(filter_data_by_period(df, YEAR_MODE)))]
+    by_month = filter_weeks_by_month(df)
+    month_list = list(by_month)[::-1]
+    if months:
+        month_list = month_list[:months]
+    for month in month_list:
+        sections.append((f"{MONTH_MODE}: {month}", f"Недели {month}", build_kpi_index(by_month[month])))
+    return sections
+
+
+def plan_tasks(sections):
+    """Задания для пула: по одному на (раздел, KPI). В процесс уходят только строки этого KPI."""
+    tasks = []
+    for s_idx, (_, prefix, kpi_index) in enumerate(sections):
+        for kpis in KPI_STRUCTURE.values():
+            for name in kpis.values():
+                rows = kpi_index.get(name)
+                if rows is not None:
+                    tasks.append((s_idx, name, prefix, rows))
+    return tasks
+
+
+def render_fragment(task):
+    """HTML-фрагмент одного графика (div + вызов Plotly.newPlot, без plotly.js)."""
+    s_idx, name, prefix, rows = task
+    fig = render_chart(rows, name, title_prefix=prefix)
+    return s_idx, name, pio.to_html(fig, full_html=False, include_plotlyjs=False)
+
+
+def render_all(tasks, jobs):
+    """Строит фрагменты в пуле процессов (jobs=1 — в текущем процессе)."""
+    if jobs <= 1 or len(tasks) < 2:
+        return [render_fragment(t) for t in tasks]
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(render_fragment, tasks, chunksize=chunksize))
+
+
+def write_report(path, sections, fragments, source):
+    """Собирает автономный HTML: оглавление, разделы по категориям KPI и plotly.js один раз."""
+    by_section = {}
+    for s_idx, name, fragment in fragments:
+        by_section.setdefault(s_idx, {})[name] = fragment
+
+    toc, body = [], []
+    for s_idx, (title, _, _) in enumerate(sections):
+        charts = by_section.get(s_idx, {})
+        if not charts:
+            continue
+        anchor = f"section-{s_idx}"
+        toc.append(f'<li><a href="#{anchor}">{html.escape(title)}</a> ({len(charts)})</li>')
+        body.append(f'<h2 id="{anchor}">{html.escape(title)}</h2>')
+        for category, kpis in KPI_STRUCTURE.items():
+            present = [charts[name] for name in kpis.values() if name in charts]
+            if present:
+                body.append(f"<h3>{html.escape(category)}</h3>")
+                body.append('<div class="grid">' + "".join(f'<div class="chart">{c}</div>' for c in present)
+                            + "</div>")
+
+    generated = datetime.now().strftime("%d.%m.%Y %H:%M")
+    page = f"""<!DOCTYPE html>
+<html lang="ru">
+<head>
+<meta charset="utf-8">
+<title>Отчет KPI — {generated}</title>
+<script type="text/javascript">{get_plotlyjs()}</script>
+<style>
+body {{ font-family: sans-serif; margin: 24px; }}
+.grid {{ display: grid; grid-template-columns: repeat(auto-fill, minmax(560px, 1fr)); gap: 12px; }}
+.chart {{ border: 1px solid #e5e5e5; border-radius: 6px; padding: 4px; }}
+</style>
+</head>
+<body>
+<h1>🕊️ Отчет KPI</h1>
+<p>Сформирован {generated}. Источник: {html.escape(source)}.</p>
+<ul>{"".join(toc)}</ul>
+{"".join(body)}
+</body>
+</html>
+"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(page)
+    return len(page)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH, help="база SQLite приложения")
+    parser.add_argument("--mock-years", type=int, default=None, help="вместо базы — синтетические данные за N лет")
+    parser.add_argument("--months", type=int, default=None, help="только последние N месяцев (по умолчанию все)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="процессов для построения графиков")
+    parser.add_argument("--output", default=None, help="HTML-файл (по умолчанию reports/)")
+    args = parser.parse_args(argv)
+
+    if not args.mock_years and not os.path.exists(args.db):
+        # KPIStore создал бы на месте опечатки пустую базу — проверяем путь заранее
+        parser.error(f"база не найдена: {args.db}")
+
+    started = time.perf_counter()
+    df = load_history(args.db, args.mock_years)
+    source = f"синтетические данные за {args.mock_years} г." if args.mock_years else args.db
+    if df.empty:
+        parser.exit(1, "Нет данных для отчета.\n")
+
+    sections = plan_sections(df, args.months)
+    tasks = plan_tasks(sections)
+    aggregated = time.perf_counter()
+
+    fragments = render_all(tasks, args.jobs)
+    rendered = time.perf_counter()
+
+    output = args.output or os.path.join("reports", f"kpi_report_{datetime.now():%Y%m%d_%H%M%S}.html")
+    size = write_report(output, sections, fragments, source)
+    print(f"Строк истории: {len(df):,}; разделов: {len(sections)}; графиков: {len(fragments)}")
+    print(f"Агрегаты: {aggregated - started:.2f} с; графики ({args.jobs} процесс.): {rendered - aggregated:.2f} с; "
+          f"всего: {time.perf_counter() - started:.2f} с")
+    print(f"Отчет сохранен: {output} ({size / 2 ** 20:.1f} МиБ)")
+
+
+if __name__ == "__main__":
+    main()